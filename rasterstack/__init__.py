@@ -1,9 +1,41 @@
-from .tiles import imageExtent, unionExtent, cropToExtent, batchCropToExtent, tileExtent, equalExtents
-from .rasterstack import RasterStack, SingleFileRasterStack, RasterTimeSeries
+from importlib import import_module
+
 from .__version__ import __version__
+# imported eagerly (as before), so that rasterstack.theilsen is the function rather than its submodule.
+# It only needs NumPy and the compiled kernel.
 from .theilsen import theilsen
 
+# public names and the submodules they come from. They are imported on first use (PEP 562),
+# so that `import rasterstack` does not load rasterio, pandas or joblib
+_exports = {
+    'RasterStack': 'rasterstack',
+    'SingleFileRasterStack': 'rasterstack',
+    'RasterTimeSeries': 'rasterstack',
+    'CubeTimeSeries': 'cube',
+    'GapFilledTimeSeries': 'gapfill',
+    'fill_gaps': 'gapfill',
+    'Pipeline': 'pipeline',
+    'imageExtent': 'tiles',
+    'unionExtent': 'tiles',
+    'cropToExtent': 'tiles',
+    'batchCropToExtent': 'tiles',
+    'tileExtent': 'tiles',
+    'equalExtents': 'tiles',
+    'valid_fraction': 'tiles',
+    'write_raster': 'writer'
+}
+
 __all__ = [
-    'RasterStack', 'SingleFileRasterStack', 'RasterTimeSeries', 'imageExtent', 'unionExtent', 'cropToExtent', 'batchCropToExtent', 'tileExtent', 'equalExtents', 'theilsen'
+    'RasterStack', 'SingleFileRasterStack', 'RasterTimeSeries', 'CubeTimeSeries', 'GapFilledTimeSeries', 'fill_gaps', 'Pipeline', 'imageExtent', 'unionExtent', 'cropToExtent', 'batchCropToExtent', 'tileExtent', 'equalExtents', 'valid_fraction', 'theilsen', 'write_raster'
 ]
 
+
+def __getattr__(name):
+    if name in _exports:
+        value = getattr(import_module('.' + _exports[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
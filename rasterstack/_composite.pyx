@@ -0,0 +1,71 @@
+cimport cython
+from cython.parallel cimport prange
+from libc.math cimport sqrt, INFINITY
+import numpy as np
+
+# observation i of pixel p is valid if all of its bands are finite (not NaN)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline bint _valid(const float[:,:,::1] x, Py_ssize_t i, Py_ssize_t p) noexcept nogil:
+    cdef Py_ssize_t b
+    for b in range(x.shape[1]):
+        if x[i,b,p] != x[i,b,p]:
+            return False
+    return True
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def select(const float[:,:,::1] x, const float[:,::1] score = None, int nthreads = 1):
+    '''
+    Returns the index (along axis 0) of the selected observation of each pixel
+
+    Args:
+    =====
+    x:          Input float32 array of shape (time, bands, pixels), with missing values set to NaN
+    score:      (optional) float32 array of shape (time, pixels). Default: None (medoid).
+    nthreads:   Number of OpenMP threads (Default: 1)
+
+    Returns:    A 1-D int32 array. -1 where the pixel has no valid observation.
+
+    If score is None, the medoid is selected (the valid observation with the smallest sum of
+    Euclidean distances to all other valid observations); otherwise, the valid observation with the highest score.
+    '''
+    cdef:
+        Py_ssize_t n = x.shape[0]
+        Py_ssize_t nb = x.shape[1]
+        Py_ssize_t npix = x.shape[2]
+        Py_ssize_t p, i, j, b
+        double s, d, diff, best
+        bint medoid = score is None
+        int[::1] out = np.full(npix, -1, dtype = np.int32)
+
+    if not medoid and (score.shape[0] != n or score.shape[1] != npix):
+        raise ValueError("score must have shape (time, pixels)")
+
+    with nogil:
+        for p in prange(npix, num_threads = nthreads, schedule = 'static'):
+            best = INFINITY
+            for i in range(n):
+                if not _valid(x, i, p):
+                    continue
+                if medoid:
+                    s = 0
+                    for j in range(n):
+                        if j == i or not _valid(x, j, p):
+                            continue
+                        d = 0
+                        for b in range(nb):
+                            diff = x[i,b,p] - x[j,b,p]
+                            d = d + diff * diff
+                        s = s + sqrt(d)
+                    if s < best:
+                        best = s
+                        out[p] = <int> i
+                else:
+                    # scores are negated so that the best (lowest) value wins, as for the medoid
+                    if score[i,p] == score[i,p] and -score[i,p] < best:
+                        best = -score[i,p]
+                        out[p] = <int> i
+
+    return np.asarray(out)
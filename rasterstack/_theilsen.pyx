@@ -2,7 +2,7 @@ cimport cython
 from cython.view cimport array as cvarray
 from cython.parallel cimport prange, parallel
 from libc.stdlib cimport qsort
-from libc.math cimport sqrt
+from libc.math cimport sqrt, NAN
 from openmp cimport omp_get_thread_num, omp_get_max_threads
 import numpy as np
 cimport numpy as np
@@ -27,7 +27,7 @@ cdef int cmp_func(const void* a, const void* b) noexcept nogil:
 
 @cython.boundscheck(False)
 cdef void sort_c(double[:] a, Py_ssize_t size) noexcept nogil:
-    qsort(&a[0], size, sizeof(char), &cmp_func)
+    qsort(&a[0], size, sizeof(double), &cmp_func)
     
 @cython.boundscheck(False)
 @cython.wraparound(False)
@@ -40,11 +40,11 @@ cdef double median(double [:] arr) nogil:
     sort_c(arr, n)
     
     if n % 2 == 0:
-        i = <int> (n/2)
-        j = i + 1
+        j = <int> (n/2)
+        i = j - 1
         arr_med = (<double> arr[i] + <double> arr[j]) / 2
     else:
-        i = <int> (n/2) + 1
+        i = <int> (n/2)
         arr_med = <double> arr[i]
     
     return arr_med
@@ -79,8 +79,9 @@ cpdef double[:,:] _theilsen(double[:,:] arr_view, double[:] x_view, int nthreads
         double[:] Z = cvarray(shape = (nx,), itemsize = sizeof(double), format = "d") # test statistic
         double[:] group = cvarray(shape = (ncomps * nthreads,), itemsize = sizeof(double), format = "d")
         double[:,:] res = cvarray(shape = (3,nx), itemsize = sizeof(double), format = "d")
-        double[:,:] v_c  = cvarray(shape = (n,nx), itemsize = sizeof(double), format = "d") ## saved for sorted array, if needed (ties)
+        double[:,:] v_c  = cvarray(shape = (nx,n), itemsize = sizeof(double), format = "d") ## saved for sorted array, if needed (ties); one contiguous row per pixel for qsort
         int[:] tp = cvarray(shape = (nx,), itemsize = sizeof(int), format = "i") # for counting ties
+        int[:] nv = cvarray(shape = (nx,), itemsize = sizeof(int), format = "i") # number of valid (not NaN) observations
         double[:] tied = cvarray(shape = (nx,), itemsize = sizeof(double), format = "d") # for counting ties
     
     with nogil, parallel(num_threads = nthreads):
@@ -89,33 +90,50 @@ cpdef double[:,:] _theilsen(double[:,:] arr_view, double[:] x_view, int nthreads
             k[x] = 0
             S[x] = 0
             g[x] = 0
+            # pairs with a missing (NaN) observation are skipped
             for i in range(n-1):
+                if arr_c[i,x] != arr_c[i,x]:
+                    continue
                 for j in range(i+1, n):
+                    if arr_c[j,x] != arr_c[j,x]:
+                        continue
                     local_slopes[ncomps * tid + k[x]] = (arr_c[j,x] - arr_c[i,x]) / (x_view[j] - x_view[i])
                     comp[x] = cmp_func(&arr_c[j,x], &arr_c[i,x])
                     if comp[x] == 0:
                         g[x] += 1
                     S[x] += comp[x]
                     k[x] += 1
+            if k[x] == 0:
+                # fewer than 2 valid observations
+                res[0,x] = NAN
+                res[1,x] = 0
+                res[2,x] = NAN
+                continue
             res[0,x] = median(local_slopes[ ncomps*tid:ncomps*tid+k[x] ])
             res[1,x] = <double> S[x]
             
-            ## Var(S)
+            ## Var(S), from the valid observations
+            nv[x] = 0
+            for i in range(n):
+                if arr_c[i,x] == arr_c[i,x]:
+                    v_c[x,nv[x]] = arr_c[i,x]
+                    nv[x] += 1
             varS[x] = 0
             if g[x] > 0:
-                v_c[:,x] = arr_c[:,x]
-                sort_c(v_c[:,x], n)
-                tp[x] = 0
-                tied[x] = v_c[0,x]
-                for i in range(1, n):
-                    if v_c[i,x] == tied[x]:
+                sort_c(v_c[x,:nv[x]], nv[x])
+                # tp: size of the current group of tied values
+                tp[x] = 1
+                tied[x] = v_c[x,0]
+                for i in range(1, nv[x]):
+                    if v_c[x,i] == tied[x]:
                         tp[x] += 1
                     else:
-                        tied[x] = v_c[i,x]
+                        tied[x] = v_c[x,i]
                         varS[x] += tp[x] * (tp[x] - 1) * (2*tp[x] + 5)
-                        tp[x] = 0
+                        tp[x] = 1
+                varS[x] += tp[x] * (tp[x] - 1) * (2*tp[x] + 5)
                 
-            varS[x] = (<double>n * (<double>n - 1) * (2*<double>n + 5) - varS[x]) / 18.
+            varS[x] = (<double>nv[x] * (<double>nv[x] - 1) * (2*<double>nv[x] + 5) - varS[x]) / 18.
             if S[x] > 0:
                 Z[x] = (S[x] - 1) / sqrt(varS[x])
             elif S[x] < 0:
@@ -129,7 +147,7 @@ cpdef double[:,:] _theilsen(double[:,:] arr_view, double[:] x_view, int nthreads
 
 def theilsen(arr, x = None, int nthreads = -1):
     '''
-    Returns the Theil-Sen slope along axis 0 of input axis.
+    Returns the Theil-Sen slope along axis 0 of input axis. Missing (NaN) observations are skipped.
 
     Args:
     =====
@@ -0,0 +1,117 @@
+'''
+Pixelwise statistics of categorical (class) time series: mode, class counts/frequencies and number of class transitions
+'''
+import numpy as np
+from functools import partial
+from joblib import Parallel, delayed
+
+CATEGORICAL_STATS = ['nobs', 'mode', 'counts', 'frequency', 'transitions']
+
+
+def default_classes(dtype, nodatavalue = None):
+    '''
+    All values of an 8-bit data type (except nodatavalue). Classes must be given explicitly for other data types.
+    '''
+    dtype = np.dtype(dtype)
+    if not dtype in [np.uint8, np.int8]:
+        raise ValueError("classes must be given for {0} rasters".format(dtype.name))
+    info = np.iinfo(dtype)
+    return [c for c in range(info.min, info.max + 1) if c != nodatavalue]
+
+def flag_value(dtype, classes):
+    '''
+    Value of dtype that is not a class, to flag pixels without valid observations: NaN for floats, otherwise the largest free value
+    '''
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.floating):
+        return np.nan
+    info = np.iinfo(dtype)
+    used = set(int(c) for c in classes)
+    for v in range(int(info.max), int(info.min) - 1, -1):
+        if not v in used:
+            return v
+    raise ValueError("every value of {0} is a class; set a nodata value (or leave out a class) to flag pixels without valid observations".format(dtype.name))
+
+def class_index(x, classes):
+    '''
+    Index of each value of x in the sorted array of classes (-1 for NaN and values that are not a class)
+    '''
+    k = np.searchsorted(classes, x)
+    k[k == len(classes)] = 0
+    return np.where(classes[k] == x, k, -1)
+
+def _categorical_chunk(read, n, classes, stats, nodatavalue, dtype, l):
+    '''
+    Accumulates class counts and transitions of a chunk, reading one file at a time with read(i, l) (a (rows, cols) float32 array)
+    '''
+    ncls = len(classes)
+    counts = None
+
+    for i in range(n):
+        x = read(i, l)
+        if counts is None:
+            rows, cols = x.shape
+            npix = rows * cols
+            counts = np.zeros((ncls, npix), dtype = np.int32)
+            prev = np.full(npix, -1, dtype = np.int32)
+            trans = np.zeros(npix, dtype = np.int32)
+
+        k = class_index(x.ravel(), classes)
+        pix = np.flatnonzero(k >= 0)
+        k = k[pix]
+
+        # flat (class, pixel) indices are unique within a file, so a buffered increment counts every observation
+        counts.reshape(-1)[k * npix + pix] += 1
+
+        p = prev[pix]
+        trans[pix] += (p >= 0) & (p != k)
+        prev[pix] = k
+
+    nobs = counts.sum(axis = 0)
+
+    out = []
+    for s in stats:
+        if s == 'nobs':
+            out.append(nobs.astype(np.int16))
+        elif s == 'mode':
+            # ties go to the first class
+            xmo = classes[counts.argmax(axis = 0)].astype(dtype)
+            xmo[nobs == 0] = nodatavalue
+            out.append(xmo)
+        elif s == 'counts':
+            out.append(counts.astype(np.int16))
+        elif s == 'frequency':
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                out.append((counts / nobs).astype(np.float32))
+        elif s == 'transitions':
+            out.append(trans.astype(np.int16))
+
+    return [o.reshape(o.shape[:-1] + (rows, cols)) for o in out]
+
+def categorical_stats(read, n, h, classes, stats = ['nobs', 'mode', 'transitions'], nodatavalue = None, dtype = np.uint8, rchunk = 100, njobs = 1, verbose = 0):
+    '''
+    Chunked categorical stats. read(i, l) should return rows l to l + rchunk of file i as a (rows, cols) float32 array (NaN where masked).
+
+    Returns: list of stats in the order requested. 'nobs' and 'transitions' are int16 arrays of shape (h, w), 'mode' has the input dtype (nodatavalue where there are no valid observations; required for 'mode', see flag_value),
+    'counts' (int16) and 'frequency' (float32, NaN where there are no valid observations) are arrays of shape (classes, h, w)
+
+    Details:
+    --------
+    Files are read one at a time, so memory grows with the number of classes and not with stack depth.
+    Values that are not in classes (e.g., nodata) are not counted. Transitions are changes of class between consecutive valid observations.
+    '''
+    if not all(s in CATEGORICAL_STATS for s in stats):
+        raise ValueError("'stats' must be one or more of {0}".format(CATEGORICAL_STATS))
+    classes = np.unique(np.asarray(classes))
+    if len(classes) == 0:
+        raise ValueError("classes should not be empty")
+    if 'mode' in stats and (nodatavalue is None or nodatavalue in classes):
+        raise ValueError("'mode' requires a nodatavalue that is not a class (see flag_value)")
+
+    fn = partial(_categorical_chunk, read, n, classes, stats, nodatavalue, dtype)
+    if njobs > 1:
+        Z = Parallel(n_jobs = njobs, verbose = verbose)(delayed(fn)(i) for i in range(0, h, rchunk))
+    else:
+        Z = [fn(i) for i in range(0, h, rchunk)]
+
+    return [np.concatenate([z[k] for z in Z], axis = -2) for k in range(len(stats))]
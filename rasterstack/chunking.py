@@ -0,0 +1,127 @@
+'''
+Memory-budget-aware chunk size and worker count selection
+'''
+import os
+import re
+import numpy as np
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+# working memory of each reducer, in multiples of the (float32) chunk buffer
+_STATS_FACTOR = {'nobs': 0.25, 'mean': 1, 'median': 1, 'std': 2}
+
+
+def parse_bytes(x):
+    '''
+    Converts a memory size (e.g., 8e9, '8G', '512MB') to bytes
+    '''
+    if isinstance(x, (int, float, np.integer, np.floating)):
+        return int(x)
+    m = re.match(r"^\s*([0-9.]+)\s*([KMGT]?)I?B?\s*$", str(x).upper())
+    if m is None:
+        raise ValueError("Could not parse memory size '{0}'".format(x))
+    return int(float(m.group(1)) * _UNITS[m.group(2)])
+
+def cpu_count():
+    '''
+    Number of available cores, or RASTERSTACK_NUM_CPUS if set (e.g., by a tile-level worker; see rasterstack.workqueue.work)
+    '''
+    if os.environ.get('RASTERSTACK_NUM_CPUS'):
+        return max(1, int(os.environ['RASTERSTACK_NUM_CPUS']))
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def row_bytes(n, w, nbands = 1, stats = ['nobs', 'mean', 'median', 'std'], kind = 'stats', nbuffers = 1, nclasses = 1, fill = None):
+    '''
+    Estimated peak memory (bytes) per image row for one worker
+
+    Arguments
+    ---------
+    n:          number of files (stack depth), or of gap-filled dates passed to the reducer (see fill)
+    w:          image width
+    nbands:     number of bands read per file [1]
+    stats:      requested stats (kind = 'stats')
+    kind:       'stats', 'trend' or 'categorical'
+    nbuffers:   number of chunk buffers held at the same time (2 for the prefetching thread backend) [1]
+    nclasses:   number of classes (kind = 'categorical') [1]
+    fill:       (optional) (number of input files, number of output dates) of a series that is gap-filled before it is reduced (see gapfill.fill_gaps) [None]
+    '''
+    if fill is not None:
+        nin, nfill = fill
+        # fill_gaps: float32 input, int32 previous/next indices (and their accumulation) and float32 output,
+        # then input, output and the subset of dates passed to the reducer
+        filled = 4. * w * max(4 * nin + nfill + 16, nin + nfill + n)
+        return int(max(filled, row_bytes(n, w, nbands, stats, kind, nbuffers, nclasses)))
+    if kind == 'categorical':
+        # files are read one at a time: float32 buffer and class index, int32 class counts, previous class and transitions
+        return int(8. * w + 4. * nclasses * w + 8. * w)
+    buf = 4. * n * nbands * w
+    if kind == 'trend':
+        # float32 buffer + float64 input, working copy and sorted copy in theilsen
+        return int(buf * nbuffers + 3 * 8. * n * w)
+    work = max([_STATS_FACTOR.get(s, 1) for s in stats] + [0]) / nbands
+    return int(buf * (nbuffers + work))
+
+def auto_chunking(mem_budget, n, w, h, nbands = 1, stats = ['nobs', 'mean', 'median', 'std'], kind = 'stats', njobs = None, backend = 'joblib', min_rows = 16, nclasses = 1, fill = None):
+    '''
+    Picks the number of rows per chunk and the number of workers that fit in a memory budget
+
+    Arguments
+    ---------
+    mem_budget: total memory budget (bytes, or string such as '8G')
+    n:          number of files (stack depth)
+    w, h:       image width and height
+    nbands:     number of bands read per file [1]
+    stats:      requested stats [['nobs', 'mean', 'median', 'std']]
+    kind:       'stats', 'trend' or 'categorical' ['stats']
+    njobs:      maximum number of workers [number of available cores]
+    backend:    'joblib' or 'threads' ['joblib']
+    min_rows:   workers are removed until each chunk has at least this many rows (or one worker is left) [16]
+    nclasses:   number of classes (kind = 'categorical') [1]
+    fill:       (optional) (number of input files, number of output dates) of a gap-filled series (see row_bytes) [None]
+
+    returns: (rchunk, njobs)
+    '''
+    budget = parse_bytes(mem_budget)
+    if njobs is None or njobs < 1:
+        njobs = cpu_count()
+
+    # full-size outputs are held in memory until the end
+    if kind == 'trend':
+        nout = 3
+    elif kind == 'categorical':
+        nout = sum(nclasses if s in ['counts', 'frequency'] else 1 for s in stats)
+    else:
+        nout = len(stats) * nbands
+    budget -= 8 * nout * w * h
+    if budget <= 0:
+        raise ValueError("Memory budget is too small to hold the outputs.")
+
+    if backend == 'threads':
+        # one reducer, two buffers shared by all reading threads
+        rchunk = budget // row_bytes(n, w, nbands, stats, kind, nbuffers = 2, nclasses = nclasses, fill = fill)
+        if rchunk < 1:
+            raise ValueError("Memory budget is too small to hold a single row of the stack.")
+        return int(min(rchunk, h)), int(njobs)
+
+    per_row = row_bytes(n, w, nbands, stats, kind, nclasses = nclasses, fill = fill)
+    njobs = min(njobs, h)
+    rchunk = budget // (njobs * per_row)
+    while njobs > 1 and rchunk < min_rows:
+        njobs -= 1
+        rchunk = budget // (njobs * per_row)
+    if rchunk < 1:
+        raise ValueError("Memory budget is too small to hold a single row of the stack.")
+
+    # balance the chunks between workers
+    rchunk = min(rchunk, int(np.ceil(h / njobs)))
+
+    return int(rchunk), int(njobs)
+
+def omp_threads(njobs):
+    '''
+    Number of OpenMP threads per worker that does not oversubscribe the available cores
+    '''
+    return max(1, cpu_count() // max(1, njobs))
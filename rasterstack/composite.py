@@ -0,0 +1,113 @@
+'''
+Best-available-pixel compositing (one observation, with all of its bands, per pixel)
+'''
+import warnings
+import numpy as np
+from functools import partial
+from joblib import Parallel, delayed
+
+from .masking import apply_mask
+
+try:
+    from ._composite import select
+except ImportError:
+    select = None
+
+# maximum number of (observation, observation, band, pixel) values held at a time by the NumPy fallback
+_BLOCK = 2 ** 24
+
+
+def _select_numpy(x, score = None, nthreads = 1):
+    '''
+    NumPy version of rasterstack._composite.select (used if the extension was not built)
+    '''
+    n, nb, npix = x.shape
+    valid = np.isfinite(x).all(axis = 1)
+
+    if score is None:
+        s = np.empty((n, npix), dtype = np.float64)
+        block = max(1, _BLOCK // (n * n * nb))
+        for p in range(0, npix, block):
+            xb = x[:, :, p:p + block].astype(np.float64)
+            d = np.sqrt(((xb[:, np.newaxis] - xb[np.newaxis]) ** 2).sum(axis = 2))
+            vb = valid[:, p:p + block]
+            d[~(vb[:, np.newaxis] & vb[np.newaxis])] = 0
+            s[:, p:p + block] = d.sum(axis = 1)
+        s[~valid] = np.inf
+        idx = s.argmin(axis = 0)
+    else:
+        valid &= np.isfinite(score)
+        idx = np.where(valid, score, -np.inf).argmax(axis = 0)
+
+    idx = idx.astype(np.int32)
+    idx[~valid.any(axis = 0)] = -1
+    return idx
+
+
+def ndvi(x, red, nir):
+    '''
+    NDVI of a (time, bands, ...) array, where red and nir are indices along the band axis
+    '''
+    r = x[:, red]
+    n = x[:, nir]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return (n - r) / (n + r)
+
+def _composite_chunk(read, method, red, nir, score, dates, nodatavalue, nthreads, l):
+    '''
+    Reads a chunk with read(l) and returns the composite (bands, rows, cols) and the index of the selected observations (rows, cols)
+    '''
+    x = read(l)
+    if nodatavalue is not None:
+        apply_mask(x, x == nodatavalue)
+    apply_mask(x, np.isinf(x))
+
+    n, nb, rows, cols = x.shape
+    x = x.reshape((n, nb, rows * cols))
+
+    if method == 'medoid':
+        s = None
+    elif method == 'maxndvi':
+        s = ndvi(x, red, nir)
+    else:
+        s = score(x.reshape((n, nb, rows, cols)), dates)
+        s = s.reshape((n, rows * cols))
+    if s is not None:
+        s = np.ascontiguousarray(s, dtype = np.float32)
+
+    if select is not None:
+        idx = select(x, s, nthreads = nthreads)
+    else:
+        warnings.warn("rasterstack._composite was not built; using the (slower) NumPy version of the selection kernel", RuntimeWarning)
+        idx = _select_numpy(x, s, nthreads = nthreads)
+
+    # all bands of the selected observation
+    comp = np.take_along_axis(x, np.maximum(idx, 0)[np.newaxis, np.newaxis, :], axis = 0)[0]
+    comp[:, idx < 0] = np.nan
+
+    return comp.reshape((nb, rows, cols)), idx.reshape((rows, cols))
+
+def composite(read, h, dates, method = 'medoid', red = None, nir = None, score = None, nodatavalue = None, rchunk = 100, njobs = 1, nthreads = 1, verbose = 0):
+    '''
+    Chunked best-available-pixel composite. read(l) should return a (time, bands, rows, cols) float32 array starting at row l.
+
+    Returns: composite (float32 array of shape (bands, h, w), NaN where there is no valid observation) and
+    index of the selected observation (int32 array of shape (h, w), -1 where there is no valid observation)
+    '''
+    if not method in ['medoid', 'maxndvi', 'score']:
+        raise ValueError("method must be one of 'medoid', 'maxndvi' or 'score'")
+    if method == 'maxndvi' and (red is None or nir is None):
+        raise ValueError("red and nir bands are required for 'maxndvi'")
+    if method == 'score' and not callable(score):
+        raise ValueError("a score function is required for 'score'")
+
+    fn = partial(_composite_chunk, read, method, red, nir, score, dates, nodatavalue, nthreads)
+    if njobs > 1:
+        Z = Parallel(n_jobs = njobs, verbose = verbose)(delayed(fn)(i) for i in range(0, h, rchunk))
+    else:
+        Z = [fn(i) for i in range(0, h, rchunk)]
+
+    comp = np.concatenate([z[0] for z in Z], axis = 1)
+    idx = np.concatenate([z[1] for z in Z], axis = 0)
+
+    return comp, idx
@@ -0,0 +1,222 @@
+'''
+Time-major chunked cubes (Zarr) for fast per-pixel time series access
+'''
+import numpy as np
+import rasterio
+from affine import Affine
+from datetime import datetime
+from functools import partial
+from joblib import Parallel, delayed
+from pandas import DataFrame
+from rasterio.crs import CRS
+
+from .tiles import equalExtents
+from .rasterstack import _read_chunk, _reduce_chunk, _stack_stats, _stats_dtype, _chunksize, _chunking, _date_metadata, _subset_dates, _decimal_years, _compute_trend
+from .writer import write_raster
+
+
+def _zarr():
+    try:
+        import zarr
+    except ImportError:
+        raise ImportError("zarr is required for chunked cubes (pip install zarr)")
+    return zarr
+
+def _write_rows(read, outfile, l):
+    x = read(l)[:,0]
+    z = _zarr().open_array(store = outfile, mode = 'r+')
+    z[:, l:l + x.shape[1], :] = x
+
+def _write_cube(read, outfile, dates, profile, chunks = (128, 128), njobs = 1, verbose = 0, **attrs):
+    '''
+    Writes a time-major cube from a chunk reader. read(l) should return a (time, 1, chunks[0], cols) array starting at row l.
+    '''
+    w = profile['width']
+    h = profile['height']
+
+    z = _zarr().open_array(store = outfile, mode = 'w', shape = (len(dates), h, w), chunks = (len(dates), min(chunks[0], h), min(chunks[1], w)), dtype = 'float32', fill_value = np.nan)
+    attrs.update({
+        'dates': [d.isoformat() for d in dates],
+        'crs': profile['crs'].to_wkt() if profile['crs'] else None,
+        'transform': list(profile['transform'])[:6],
+        'nodata': profile['nodata'],
+        'dtype': profile['dtype']
+    })
+    z.attrs.update(attrs)
+
+    # write whole rows of chunks so that no chunk is written twice
+    fn = partial(_write_rows, read, outfile)
+    if njobs > 1:
+        Parallel(n_jobs = njobs, verbose = verbose)(delayed(fn)(i) for i in range(0, h, chunks[0]))
+    else:
+        [fn(i) for i in range(0, h, chunks[0])]
+
+    return outfile
+
+def to_cube(fl, dates, outfile, band = 1, maskband = None, maskvalue = None, maskbits = None, maskfiles = None, chunks = (128, 128), njobs = 1, verbose = 0):
+    '''
+    Rewrites a stack of single-date rasters into a time-major chunked (Zarr) cube
+
+    Arguments
+    ---------
+    fl:         list of raster filenames (aligned extents)
+    dates:      list of datetime.datetime objects corresponding to each file in fl
+    outfile:    output Zarr store (directory)
+    band:       band to be written to the cube [1]
+    maskband:   (optional) integer band number to be used for masking
+    maskvalue:  (optional) value or list/set of values in mask band to be masked (Default: 1, unless maskbits is given)
+    maskbits:   (optional) list of bit positions in mask band to be masked
+    maskfiles:  (optional) list of mask filenames corresponding to each file in fl
+    chunks:     spatial (rows, cols) chunk size; each chunk holds the complete time series [(128, 128)]
+    njobs:      number of jobs (for parallel processing) [1]
+    verbose:    verbosity (0-100) [0]
+
+    Details:
+    --------
+    Values are stored as float32 (time, rows, cols), sorted by date, with masked and nodata pixels set to NaN.
+    Dates and georeferencing are stored in the array attributes.
+    '''
+    if len(dates) != len(fl):
+        raise ValueError("dates should be the same length as fl")
+    if not equalExtents(fl):
+        raise ValueError("Rasters do not have aligned extents.")
+    if maskvalue is None and maskbits is None:
+        maskvalue = 1
+    if maskfiles is None:
+        maskfiles = [None] * len(fl)
+
+    order = np.argsort(np.array(dates, dtype = 'datetime64[us]'), kind = 'stable')
+    fl = [fl[i] for i in order]
+    dates = [dates[i] for i in order]
+    maskfiles = [maskfiles[i] for i in order]
+
+    with rasterio.open(fl[0]) as src:
+        profile = src.profile
+
+    read = partial(_read_chunk, fl, [band], maskband, maskvalue, maskbits, maskfiles, chunks[0], profile['width'], profile['height'])
+
+    return _write_cube(read, outfile, dates, profile, chunks = chunks, njobs = njobs, verbose = verbose, filenames = list(fl), band = band)
+
+
+def _read_cube_chunk(infile, tidx, rchunk, h, l):
+    '''
+    Reads rows l to l + rchunk of a cube into a float32 array of shape (time, 1, rows, cols)
+    '''
+    chunk = _chunksize(l, rchunk, h)
+    z = _zarr().open_array(store = infile, mode = 'r')
+    x = z[:, l:l + chunk, :]
+    if tidx is not None:
+        x = x[tidx]
+    return x[:, np.newaxis]
+
+def _cubestats(infile, tidx, stats, rchunk, h, nodatavalue, dtype, l):
+    x = _read_cube_chunk(infile, tidx, rchunk, h, l)[:,0]
+    return _reduce_chunk(x, stats, nodatavalue, dtype)
+
+
+class CubeTimeSeries(object):
+    '''
+    Time series backed by a time-major chunked cube (see to_cube)
+
+    Arguments
+    ---------
+    infile:     Zarr store written by to_cube
+    '''
+    def __init__(self, infile):
+        z = _zarr().open_array(store = infile, mode = 'r')
+        attrs = dict(z.attrs)
+
+        self.filename = infile
+        self.chunks = z.chunks
+        self.profile = {
+            'driver': 'GTiff',
+            'dtype': attrs['dtype'],
+            'nodata': attrs['nodata'],
+            'width': z.shape[2],
+            'height': z.shape[1],
+            'count': 1,
+            'crs': CRS.from_wkt(attrs['crs']) if attrs['crs'] else None,
+            'transform': Affine(*attrs['transform'])
+        }
+        aff = self.profile['transform']
+        self.extent = (aff[2], aff[5] + z.shape[1] * aff[4], aff[2] + z.shape[2] * aff[0], aff[5])
+
+        dates = [datetime.fromisoformat(d) for d in attrs['dates']]
+        self.data = _date_metadata(DataFrame({'index': np.arange(len(dates))}), dates)
+
+    def _tidx(self, df):
+        if len(df) == len(self.data):
+            return None
+        return np.array(df['index'])
+
+    def _chunking(self, mem_budget, rchunk, njobs, **kwargs):
+        if mem_budget is None:
+            return (self.chunks[1] if rchunk is None else rchunk), (1 if njobs is None else njobs)
+        # whole cube chunks are read, whatever the subset
+        rchunk, njobs = _chunking(mem_budget, rchunk, njobs, self.chunks[0], self.profile['width'], self.profile['height'], **kwargs)
+        if rchunk > self.chunks[1]:
+            rchunk -= rchunk % self.chunks[1]
+        return rchunk, njobs
+
+    def compute_stats(self, months = None, years = None, doys = None, seasons = None, quarters = None, stats = ['nobs', 'mean', 'median', 'std'], outfile = None, rchunk = None, njobs = None, verbose = 0, mem_budget = None):
+        '''
+        Compute pixel-based descriptive stats
+
+        Arguments
+        ---------
+        months, years, doys, seasons, quarters: temporal subset (see RasterTimeSeries.compute_stats)
+        stats:      stats to be computed (must be one or more of ['nobs', 'mean', 'median', 'std']
+        outfile:    (optional) output filename (multi-band raster where number of bands = len(stats))
+        rchunk:     number of rows to process at a time [cube chunk rows]
+        njobs:      number of jobs (for parallel processing) [1]
+        verbose:    verbosity (0-100) [0]
+        mem_budget: (optional) memory budget (bytes, or e.g. '8G'); if given, rchunk and njobs (up to njobs, or all cores) are chosen from the cube size and stats
+        '''
+        if not isinstance(stats, list):
+            stats = [stats]
+        if not all(s in ['nobs', 'mean', 'median', 'std'] for s in stats):
+            raise ValueError("'stats' must be one or more of ['nobs', 'mean', 'median', 'std']")
+
+        df = _subset_dates(self.data, months = months, years = years, doys = doys, seasons = seasons, quarters = quarters)
+        h = self.profile['height']
+        rchunk, njobs = self._chunking(mem_budget, rchunk, njobs, stats = stats)
+
+        fn = partial(_cubestats, self.filename, self._tidx(df), stats, rchunk, h, self.profile['nodata'], self.profile['dtype'])
+        if njobs > 1:
+            Z = Parallel(n_jobs = njobs, verbose = verbose)(delayed(fn)(i) for i in range(0, h, rchunk))
+        else:
+            Z = [fn(i) for i in range(0, h, rchunk)]
+
+        out = _stack_stats(Z, stats, _stats_dtype(self.profile['dtype']))
+
+        if outfile:
+            write_raster(outfile, np.stack(out), self.profile)
+
+        return out
+
+    def trend(self, months = None, years = None, doys = None, seasons = None, quarters = None, outfile = None, rchunk = None, njobs = None, mem_budget = None, **kwargs):
+        '''
+        Compute pixel-based Theil-Sen slope (per year) and Mann-Kendall test
+
+        Arguments
+        ---------
+        months, years, doys, seasons, quarters: temporal subset (see RasterTimeSeries.compute_stats)
+        outfile:    (optional) output filename (3-band float32 raster: slope, sign index, Z)
+        rchunk:     number of rows to process at a time [cube chunk rows]
+        njobs:      number of jobs (for parallel processing) [1]
+        mem_budget: (optional) memory budget (bytes, or e.g. '8G'); if given, rchunk and njobs (up to njobs, or all cores) are chosen from the cube size
+
+        Keyword arguments (kwargs)
+        --------------------------
+        nthreads:   number of OpenMP threads used by theilsen in each job [cores / njobs]
+        verbose:    verbosity (0-100) [0]
+
+        Returns: Theil-Sen slope, Mann-Kendall sign index and Z-statistic over the valid observations of each pixel. Pixels with fewer than 2 valid observations are NaN.
+        '''
+        df = _subset_dates(self.data, months = months, years = years, doys = doys, seasons = seasons, quarters = quarters)
+        h = self.profile['height']
+        rchunk, njobs = self._chunking(mem_budget, rchunk, njobs, kind = 'trend')
+
+        read = partial(_read_cube_chunk, self.filename, self._tidx(df), rchunk, h)
+
+        return _compute_trend(read, _decimal_years(df['date']), h, self.profile, outfile = outfile, rchunk = rchunk, njobs = njobs, **kwargs)
@@ -0,0 +1,242 @@
+'''
+Temporal gap-filling (interpolation of masked observations to a regular time step)
+'''
+import numpy as np
+from datetime import timedelta
+from functools import partial
+from joblib import Parallel, delayed
+from pandas import DataFrame
+
+from .rasterstack import _read_chunk, _reduce_chunk, _stack_stats, _stats_dtype, _chunking, _date_metadata, _subset_dates, _decimal_years, _compute_trend, _maskfiles
+from .masking import apply_mask
+from .writer import write_raster
+
+
+def fill_gaps(x, t, tout = None, method = 'linear', max_gap = None):
+    '''
+    Fills missing (NaN) observations along the first (time) axis of an array
+
+    Arguments
+    ---------
+    x:          float array of shape (time, ...) with missing observations set to NaN
+    t:          sorted observation times (e.g., days), one per item of the first axis of x
+    tout:       (optional) output times, in the same units as t [t]
+    method:     'linear' (linear interpolation between the previous and next valid observations) or 'nearest' (nearest valid observation in time) ['linear']
+    max_gap:    (optional) maximum time between the previous and next valid observations for a value to be filled [None]
+
+    Returns: float32 array of shape (len(tout), ...)
+
+    Details:
+    --------
+    The previous and next valid observation of every pixel are found with cumulative max/min of their (int32) indices along the time axis;
+    output times are then filled one at a time with vectorized operations over all pixels. Besides the input, memory is about 12 bytes per
+    input value and 4 bytes per output value (see chunking.row_bytes). Output times before the first or after the last valid
+    observation of a pixel are not extrapolated (NaN). Valid observations at output times are returned unchanged.
+    '''
+    if not method in ['linear', 'nearest']:
+        raise ValueError("method must be one of 'linear' or 'nearest'")
+
+    t = np.asarray(t, dtype = np.float64)
+    tout = t if tout is None else np.asarray(tout, dtype = np.float64)
+    if len(t) != x.shape[0]:
+        raise ValueError("t should be the same length as the first axis of x")
+    if np.any(np.diff(t) < 0):
+        raise ValueError("t must be sorted")
+
+    n = x.shape[0]
+    m = len(tout)
+    x2 = x.reshape((n, -1))
+    cols = np.arange(x2.shape[1])
+
+    # index of the previous (next) valid observation at each time step (int32, accumulated in place)
+    valid = np.isfinite(x2)
+    idx = np.arange(n, dtype = np.int32)[:, np.newaxis]
+    prev = np.where(valid, idx, np.int32(-1))
+    np.maximum.accumulate(prev, axis = 0, out = prev)
+    nxt = np.where(valid, idx, np.int32(n))
+    del valid
+    nxt = np.minimum.accumulate(nxt[::-1], axis = 0)[::-1]
+
+    # ... and at each output time
+    kp = np.searchsorted(t, tout, side = 'right') - 1
+    kn = np.searchsorted(t, tout, side = 'left')
+
+    # one output time at a time, so that temporaries have the size of one image (rather than one per output time)
+    out = np.full((m, x2.shape[1]), np.nan, dtype = np.float32)
+    for k in range(m):
+        if kp[k] < 0 or kn[k] >= n:
+            # no extrapolation
+            continue
+        ip = prev[kp[k]]
+        inx = nxt[kn[k]]
+        ok = (ip >= 0) & (inx < n)
+        ip = np.clip(ip, 0, n - 1)
+        inx = np.clip(inx, 0, n - 1)
+
+        xp = x2[ip, cols]
+        xn = x2[inx, cols]
+        tp = t[ip]
+        tn = t[inx]
+        dt = tn - tp
+
+        if method == 'linear':
+            wgt = np.divide(tout[k] - tp, dt, out = np.zeros_like(dt), where = dt > 0)
+            y = xp + wgt * (xn - xp)
+        else:
+            y = np.where((tout[k] - tp) <= (tn - tout[k]), xp, xn)
+
+        if max_gap is not None:
+            ok &= dt <= max_gap
+        out[k] = np.where(ok, y, np.nan)
+
+    return out.reshape((m,) + x.shape[1:])
+
+def regular_dates(start, end, step = 16):
+    '''
+    Returns a list of datetimes from start to end (inclusive) every step days
+    '''
+    n = int((end - start) / timedelta(days = step))
+    return [start + timedelta(days = step * i) for i in range(n + 1)]
+
+def _days(dates):
+    return np.array(dates, dtype = 'datetime64[s]').astype(np.float64) / 86400.
+
+def _read_filled(read, t, tout, tidx, method, max_gap, nodatavalue, l):
+    '''
+    Reads a chunk of the input series with read(l) and returns the filled (time, 1, rows, cols) series at the output times
+    '''
+    x = read(l)
+    if nodatavalue is not None:
+        apply_mask(x, x == nodatavalue)
+    apply_mask(x, np.isinf(x))
+
+    y = fill_gaps(x, t, tout, method = method, max_gap = max_gap)
+    if tidx is not None:
+        y = y[tidx]
+    return y
+
+def _filledstats(read, stats, nodatavalue, dtype, l):
+    return _reduce_chunk(read(l)[:,0], stats, nodatavalue, dtype)
+
+
+class GapFilledTimeSeries(object):
+    '''
+    Gap-filled, regular time series computed on the fly from a RasterTimeSeries (see RasterTimeSeries.gapfill)
+
+    Arguments
+    ---------
+    rts:        RasterTimeSeries
+    dates:      list of output datetime.datetime objects
+    band:       band to be filled [1]
+    method:     'linear' or 'nearest' ['linear']
+    max_gap:    (optional) maximum time (days) between the previous and next valid observations for a value to be filled [None]
+    maskband:   (optional) integer band number to be used for masking
+    maskvalue:  (optional) value or list/set of values in mask band to be masked (Default: 1, unless maskbits is given)
+    maskbits:   (optional) list of bit positions in mask band to be masked
+
+    Details:
+    --------
+    Nothing is computed until compute_stats, trend or to_cube is called. Each chunk of rows is then read from all input files,
+    filled and passed directly to the reducer, so the regular series is never written to disk unless to_cube is used.
+    '''
+    def __init__(self, rts, dates, band = 1, method = 'linear', max_gap = None, maskband = None, maskvalue = None, maskbits = None):
+        if not method in ['linear', 'nearest']:
+            raise ValueError("method must be one of 'linear' or 'nearest'")
+        if maskvalue is None and maskbits is None:
+            maskvalue = 1
+
+        self.source = rts
+        self.profile = rts.profile
+        self.extent = rts.extent
+        self.band = band
+        self.method = method
+        self.max_gap = max_gap
+        self.mask = (maskband, maskvalue, maskbits)
+        self.data = _date_metadata(DataFrame({'index': np.arange(len(dates))}), sorted(dates))
+
+    def _reader(self, tidx, rchunk):
+        df = self.source.data
+        fl = list(df['filename'])
+        maskfiles = _maskfiles(df) or [None] * len(df)
+        read = partial(_read_chunk, fl, [self.band], self.mask[0], self.mask[1], self.mask[2], maskfiles, rchunk, self.profile['width'], self.profile['height'])
+        return partial(_read_filled, read, _days(df['date']), _days(self.data['date']), tidx, self.method, self.max_gap, self.profile['nodata'])
+
+    def _tidx(self, df):
+        if len(df) == len(self.data):
+            return None
+        return np.array(df['index'])
+
+    def _chunking(self, mem_budget, rchunk, njobs, n, **kwargs):
+        # the reducer gets n of the filled dates; filling needs memory for every input file and output date
+        return _chunking(mem_budget, rchunk, njobs, n, self.profile['width'], self.profile['height'], fill = (len(self.source.data), len(self.data)), **kwargs)
+
+    def compute_stats(self, months = None, years = None, doys = None, seasons = None, quarters = None, stats = ['nobs', 'mean', 'median', 'std'], outfile = None, rchunk = None, njobs = None, verbose = 0, mem_budget = None):
+        '''
+        Compute pixel-based descriptive stats of the gap-filled series
+
+        Arguments
+        ---------
+        months, years, doys, seasons, quarters: temporal subset of the output dates (see RasterTimeSeries.compute_stats)
+        stats:      stats to be computed (must be one or more of ['nobs', 'mean', 'median', 'std']
+        outfile:    (optional) output filename (multi-band raster where number of bands = len(stats))
+        rchunk:     number of rows to process at a time [100]
+        njobs:      number of jobs (for parallel processing) [1]
+        verbose:    verbosity (0-100) [0]
+        mem_budget: (optional) memory budget (bytes, or e.g. '8G'); if given, rchunk and njobs (up to njobs, or all cores) are chosen from the series length and width
+        '''
+        if not isinstance(stats, list):
+            stats = [stats]
+        if not all(s in ['nobs', 'mean', 'median', 'std'] for s in stats):
+            raise ValueError("'stats' must be one or more of ['nobs', 'mean', 'median', 'std']")
+
+        df = _subset_dates(self.data, months = months, years = years, doys = doys, seasons = seasons, quarters = quarters)
+        h = self.profile['height']
+        rchunk, njobs = self._chunking(mem_budget, rchunk, njobs, len(df), stats = stats)
+
+        fn = partial(_filledstats, self._reader(self._tidx(df), rchunk), stats, self.profile['nodata'], self.profile['dtype'])
+        if njobs > 1:
+            Z = Parallel(n_jobs = njobs, verbose = verbose)(delayed(fn)(i) for i in range(0, h, rchunk))
+        else:
+            Z = [fn(i) for i in range(0, h, rchunk)]
+
+        out = _stack_stats(Z, stats, _stats_dtype(self.profile['dtype']))
+
+        if outfile:
+            write_raster(outfile, np.stack(out), self.profile)
+
+        return out
+
+    def trend(self, months = None, years = None, doys = None, seasons = None, quarters = None, outfile = None, rchunk = None, njobs = None, mem_budget = None, **kwargs):
+        '''
+        Compute pixel-based Theil-Sen slope (per year) and Mann-Kendall test on the gap-filled series
+
+        Arguments
+        ---------
+        months, years, doys, seasons, quarters: temporal subset of the output dates (see RasterTimeSeries.compute_stats)
+        outfile:    (optional) output filename (3-band float32 raster: slope, sign index, Z)
+        rchunk:     number of rows to process at a time [100]
+        njobs:      number of jobs (for parallel processing) [1]
+        mem_budget: (optional) memory budget (bytes, or e.g. '8G'); if given, rchunk and njobs (up to njobs, or all cores) are chosen from the series length and width
+
+        Keyword arguments (kwargs)
+        --------------------------
+        nthreads:   number of OpenMP threads used by theilsen in each job [cores / njobs]
+        verbose:    verbosity (0-100) [0]
+
+        Returns: Theil-Sen slope, Mann-Kendall sign index and Z-statistic. Unfilled gaps are skipped; pixels with fewer than 2 valid values are NaN.
+        '''
+        df = _subset_dates(self.data, months = months, years = years, doys = doys, seasons = seasons, quarters = quarters)
+        h = self.profile['height']
+        rchunk, njobs = self._chunking(mem_budget, rchunk, njobs, len(df), kind = 'trend')
+
+        return _compute_trend(self._reader(self._tidx(df), rchunk), _decimal_years(df['date']), h, self.profile, outfile = outfile, rchunk = rchunk, njobs = njobs, **kwargs)
+
+    def to_cube(self, outfile, chunks = (128, 128), njobs = 1, verbose = 0):
+        '''
+        Writes the gap-filled series into a time-major chunked cube (see rasterstack.cube.to_cube)
+
+        Returns: a CubeTimeSeries
+        '''
+        from .cube import _write_cube, CubeTimeSeries
+        _write_cube(self._reader(None, chunks[0]), outfile, list(self.data['date']), self.profile, chunks = chunks, njobs = njobs, verbose = verbose, band = self.band, method = self.method, max_gap = self.max_gap)
+        return CubeTimeSeries(outfile)
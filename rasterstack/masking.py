@@ -0,0 +1,65 @@
+'''
+Functions for masking with QA bands
+'''
+import numpy as np
+from functools import lru_cache
+
+
+def _as_tuple(x):
+    if x is None:
+        return ()
+    if np.isscalar(x):
+        return (x,)
+    return tuple(sorted(x))
+
+@lru_cache(maxsize = 32)
+def _mask_lut(values, bits, dtype):
+    '''
+    Lookup table of length 2**nbits that is True for every value to be masked
+    '''
+    dtype = np.dtype(dtype)
+    lut = np.zeros(2 ** (8 * dtype.itemsize), dtype = bool)
+    codes = np.arange(lut.shape[0], dtype = np.int64)
+    if len(values) > 0:
+        lut[[int(v) for v in values if 0 <= v < lut.shape[0]]] = True
+    if len(bits) > 0:
+        bitmask = sum(1 << int(b) for b in bits)
+        lut |= (codes & bitmask) != 0
+    lut.setflags(write = False)
+    return lut
+
+def qa_mask(qa, values = None, bits = None):
+    '''
+    Boolean mask from a QA array
+
+    Arguments
+    ---------
+    qa:         QA (or mask) array
+    values:     (optional) value or list/set of values to be masked
+    bits:       (optional) list of bit positions (0 = least significant bit); values with any of these bits set are masked
+
+    returns: boolean array of the same shape as qa (True = masked)
+    '''
+    values = _as_tuple(values)
+    bits = _as_tuple(bits)
+
+    if qa.dtype.kind == 'u' and qa.dtype.itemsize <= 2:
+        # single gather from a (cached) lookup table
+        return _mask_lut(values, bits, qa.dtype.str)[qa]
+
+    out = np.zeros(qa.shape, dtype = bool)
+    if len(values) > 0:
+        np.logical_or(out, np.isin(qa, values), out = out)
+    if len(bits) > 0:
+        if not np.issubdtype(qa.dtype, np.integer):
+            raise ValueError("bits can only be used with an integer QA band")
+        bitmask = sum(1 << int(b) for b in bits)
+        np.logical_or(out, np.bitwise_and(qa, bitmask) != 0, out = out)
+    return out
+
+def apply_mask(x, mask):
+    '''
+    Sets x to NaN where mask is True (in place, without index arrays)
+    '''
+    np.copyto(x, np.nan, where = mask)
+    return x
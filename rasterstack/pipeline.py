@@ -0,0 +1,211 @@
+'''
+Lazy chains of operations (subset, mask, band math, reduce, trend) executed in a single pass per chunk
+'''
+import numpy as np
+from functools import partial
+from joblib import Parallel, delayed
+
+from .rasterstack import _read_chunk, _reduce_chunk, _stack_stats, _stats_dtype, _chunking, _subset_dates, _decimal_years, _compute_trend, _maskfiles
+from .masking import apply_mask
+from .writer import write_raster
+
+
+def normdiff(a, b):
+    '''
+    Normalized difference (a - b) / (a + b), e.g., NDVI = normdiff(nir, red)
+    '''
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return (a - b) / (a + b)
+
+def _pipeline_read(read, ops, index, nodatavalue, l):
+    '''
+    Reads a chunk with read(l) and applies the band math operations. Returns a (time, 1, rows, cols) float32 array.
+    '''
+    x = read(l)
+    if nodatavalue is not None:
+        apply_mask(x, x == nodatavalue)
+    apply_mask(x, np.isinf(x))
+
+    y = x[:, index[None]] if None in index else None
+    for fn, bands in ops:
+        args = [y] if bands is None else [x[:, index[b]] for b in bands]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            y = fn(*args)
+
+    y = np.asarray(y, dtype = np.float32)
+    apply_mask(y, np.isinf(y))
+    return y[:, np.newaxis]
+
+def _pipeline_stats(read, stats, nodatavalue, dtype, l):
+    return _reduce_chunk(read(l)[:,0], stats, nodatavalue, dtype)
+
+
+class Pipeline(object):
+    '''
+    Lazy chain of operations on a RasterStack or RasterTimeSeries (see RasterStack.pipeline)
+
+    Arguments
+    ---------
+    stack:      RasterStack or RasterTimeSeries
+    band:       band used when no band math is given, or by band math operations applied to the current value [1]
+
+    Details:
+    --------
+    subset, mask, select, bandmath and normdiff return a new Pipeline and do not read any data.
+    compute_stats and trend build a single plan: every band needed by the chain (and the mask band) is read with one call per file
+    and chunk of rows, and the chunk goes through masking, band math and the reducer in memory, so no intermediate rasters are written.
+    '''
+    def __init__(self, stack, band = 1, data = None, maskargs = None, ops = None):
+        self.stack = stack
+        self.profile = stack.profile
+        self.band = band
+        self.data = stack.data if data is None else data
+        self.maskargs = maskargs
+        self.ops = [] if ops is None else ops
+
+    def _copy(self, **kwargs):
+        args = dict(band = self.band, data = self.data, maskargs = self.maskargs, ops = list(self.ops))
+        args.update(kwargs)
+        return Pipeline(self.stack, **args)
+
+    def subset(self, months = None, years = None, doys = None, seasons = None, quarters = None):
+        '''
+        Temporal subset (see RasterTimeSeries.compute_stats). Only the selected files are read.
+        '''
+        if not 'date' in self.data:
+            raise ValueError("temporal subsets require a RasterTimeSeries")
+        return self._copy(data = _subset_dates(self.data, months = months, years = years, doys = doys, seasons = seasons, quarters = quarters))
+
+    def mask(self, maskband = None, maskvalue = None, maskbits = None):
+        '''
+        QA masking (see RasterTimeSeries.compute_stats). The mask band is read together with the data.
+        '''
+        if maskvalue is None and maskbits is None:
+            maskvalue = 1
+        return self._copy(maskargs = (maskband, maskvalue, maskbits))
+
+    def select(self, band):
+        '''
+        Continues the chain with a single band
+        '''
+        return self._copy(ops = self.ops + [(np.asarray, [band])])
+
+    def bandmath(self, fn, bands = None):
+        '''
+        Applies fn to a list of bands (fn(*[band arrays])), or to the current value if bands is None.
+        Arrays have shape (time, rows, cols), with masked and nodata pixels set to NaN.
+        '''
+        if bands is not None and not isinstance(bands, list):
+            bands = [bands]
+        return self._copy(ops = self.ops + [(fn, bands)])
+
+    def normdiff(self, b1, b2):
+        '''
+        Normalized difference of two bands, (b1 - b2) / (b1 + b2)
+        '''
+        return self.bandmath(normdiff, [b1, b2])
+
+    def _bands(self):
+        '''
+        Returns the (sorted) bands read by the chain and their index in each chunk. None is the band at the start of the chain, if used.
+        '''
+        start = len(self.ops) == 0 or self.ops[0][1] is None
+        bands = [self.band] if start else []
+        for fn, b in self.ops:
+            bands.extend(b or [])
+        bands = sorted(set(bands))
+        index = {b: i for i, b in enumerate(bands)}
+        if start:
+            index[None] = index[self.band]
+        return bands, index
+
+    def _plan(self, rchunk):
+        '''
+        Returns the fused chunk reader and the output profile
+        '''
+        bands, index = self._bands()
+
+        maskband, maskvalue, maskbits = self.maskargs or (None, None, None)
+        # as in compute_stats, mask files mask value 1 by default
+        if maskvalue is None and maskbits is None:
+            maskvalue = 1
+        if maskband in bands and not 'maskfile' in self.data:
+            raise ValueError("band numbers and maskband number should not be the same.")
+        maskfiles = _maskfiles(self.data) or [None] * len(self.data)
+
+        h = self.profile['height']
+        w = self.profile['width']
+        read = partial(_read_chunk, list(self.data['filename']), bands, maskband, maskvalue, maskbits, maskfiles, rchunk, w, h)
+        read = partial(_pipeline_read, read, self.ops, index, self.profile['nodata'])
+
+        profile = self.profile
+        if any(fn is not np.asarray for fn, b in self.ops):
+            profile = dict(profile, dtype = 'float32', nodata = np.nan)
+
+        return read, profile
+
+    def compute_stats(self, stats = ['nobs', 'mean', 'median', 'std'], outfile = None, rchunk = None, njobs = None, verbose = 0, mem_budget = None):
+        '''
+        Compute pixel-based descriptive stats at the end of the chain
+
+        Arguments
+        ---------
+        stats:      stats to be computed (must be one or more of ['nobs', 'mean', 'median', 'std']
+        outfile:    (optional) output filename (multi-band raster where number of bands = len(stats))
+        rchunk:     number of rows to process at a time [100]
+        njobs:      number of jobs (for parallel processing) [1]
+        verbose:    verbosity (0-100) [0]
+        mem_budget: (optional) memory budget (bytes, or e.g. '8G'); if given, rchunk and njobs (up to njobs, or all cores) are chosen from stack depth, width, bands and stats
+
+        Details:
+        --------
+        Outputs are float32 (with NaN nodata) if the chain includes band math.
+        '''
+        if not isinstance(stats, list):
+            stats = [stats]
+        if not all(s in ['nobs', 'mean', 'median', 'std'] for s in stats):
+            raise ValueError("'stats' must be one or more of ['nobs', 'mean', 'median', 'std']")
+
+        h = self.profile['height']
+        rchunk, njobs = _chunking(mem_budget, rchunk, njobs, len(self.data), self.profile['width'], h, nbands = len(self._bands()[0]), stats = stats)
+        read, profile = self._plan(rchunk)
+
+        fn = partial(_pipeline_stats, read, stats, profile['nodata'], profile['dtype'])
+        if njobs > 1:
+            Z = Parallel(n_jobs = njobs, verbose = verbose)(delayed(fn)(i) for i in range(0, h, rchunk))
+        else:
+            Z = [fn(i) for i in range(0, h, rchunk)]
+
+        out = _stack_stats(Z, stats, _stats_dtype(profile['dtype']))
+
+        if outfile:
+            write_raster(outfile, np.stack(out), profile)
+
+        return out
+
+    def trend(self, outfile = None, rchunk = None, njobs = None, mem_budget = None, **kwargs):
+        '''
+        Compute pixel-based Theil-Sen slope (per year) and Mann-Kendall test at the end of the chain (RasterTimeSeries only)
+
+        Arguments
+        ---------
+        outfile:    (optional) output filename (3-band float32 raster: slope, sign index, Z)
+        rchunk:     number of rows to process at a time [100]
+        njobs:      number of jobs (for parallel processing) [1]
+        mem_budget: (optional) memory budget (bytes, or e.g. '8G'); if given, rchunk and njobs (up to njobs, or all cores) are chosen from stack depth and width
+
+        Keyword arguments (kwargs)
+        --------------------------
+        nthreads:   number of OpenMP threads used by theilsen in each job [cores / njobs]
+        verbose:    verbosity (0-100) [0]
+
+        Returns: Theil-Sen slope, Mann-Kendall sign index and Z-statistic over the valid observations of each pixel. Pixels with fewer than 2 valid observations are NaN.
+        '''
+        if not 'date' in self.data:
+            raise ValueError("trend requires a RasterTimeSeries")
+
+        h = self.profile['height']
+        rchunk, njobs = _chunking(mem_budget, rchunk, njobs, len(self.data) * len(self._bands()[0]), self.profile['width'], h, kind = 'trend')
+        read, profile = self._plan(rchunk)
+
+        return _compute_trend(read, _decimal_years(self.data['date']), h, profile, outfile = outfile, rchunk = rchunk, njobs = njobs, **kwargs)
@@ -7,48 +7,113 @@ from datetime import date, datetime, timedelta
 from pandas import DataFrame, Series
 from collections import OrderedDict
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import os
 
-from .tiles import equalExtents, imageExtent
+from .tiles import equalExtents, imageExtent, count_nobs, batch_valid_pixels, batch_valid_fraction
+from .writer import write_raster
+from .masking import qa_mask, apply_mask
+from .theilsen import theilsen
+from .chunking import auto_chunking, omp_threads
 
 
 class RasterStack(object):
-    def __init__(self, fl):
+    '''
+    Arguments
+    ---------
+    fl:         List of filenames pointing to rasters
+    maskfiles:  (optional) List of mask (e.g., QA) filenames corresponding to each file in fl
+    min_valid_fraction: (optional) drop files with a smaller fraction of valid pixels in band 1 (estimated from overviews, if available; see filter_valid)
+    '''
+    def __init__(self, fl, maskfiles = None, min_valid_fraction = None):
         if not equalExtents(fl):
             raise ValueError("Input rasters should have the same extent.")
 
         self.data = DataFrame({'filename': fl, 'nobs': [None] * len(fl)})
+        if maskfiles is not None:
+            if len(maskfiles) != len(fl):
+                raise ValueError("maskfiles should be the same length as fl")
+            self.data['maskfile'] = maskfiles
         self.extent = imageExtent(fl[0])
         self.profile = rasterio.open(fl[0]).profile
 
-    def compute_stats(self, band = 1, stats = ['nobs', 'mean', 'median', 'std'], outfile = None, maskband = None, maskvalue = 1, **kwargs):
+        if min_valid_fraction is not None:
+            self.filter_valid(min_valid_fraction)
+
+    def compute_stats(self, band = 1, stats = ['nobs', 'mean', 'median', 'std'], outfile = None, maskband = None, maskvalue = None, maskbits = None, bands = None, **kwargs):
         '''
         Compute pixel-based descriptive stats
 
         Arguments
         ---------
         band:       band to open when computing stats
+        bands:      (optional) list of bands to compute stats for in a single pass (overrides band). See details.
         stats:      stats to be computed (must be one or more of ['nobs', 'mean', 'median', 'std']
-        outfile:    (optional) output filename (multi-band raster where number of bands = len(stats))
-        maskband:   (optional) integer band number for mask band
-        maskvalue:  (optional) value in mask band to be masked (Default: 1)
+        outfile:    (optional) output filename (multi-band raster where number of bands = len(stats), or len(bands) * len(stats))
+        maskband:   (optional) integer band number for mask band (band in the mask files if maskfiles were given; Default: 1)
+        maskvalue:  (optional) value or list/set of values in mask band to be masked (Default: 1, unless maskbits is given)
+        maskbits:   (optional) list of bit positions in mask band to be masked (e.g., QA cloud, shadow, snow bits)
 
         Keyword arguments (kwargs)
         --------------------------
         rchunk:     number of rows to process at a time [100]
         njobs:      number of jobs (for parallel processing) [1]
         verbose:    verbosity (0-100) [0]
+        backend:    'joblib' (process-based parallel chunks) or 'threads' (thread pool prefetching the next chunk while the current one is reduced) ['joblib']
+        mem_budget: (optional) memory budget (bytes, or e.g. '8G'); if given, rchunk and njobs (up to njobs, or all cores) are chosen from stack depth, width, bands and stats
+
+        Details:
+        --------
+        If bands is given, every requested band of each chunk is read with a single call per file, and a list (one item per band) of lists of stats is returned.
+        In the output file, stats are ordered by band, then by stat.
         '''
-        if maskband == band:
+        if maskband == band and not 'maskfile' in self.data:
             raise ValueError("band number and maskband number should not be the same.")
 
-        return _compute_stats(self.data['filename'], band = band, stats = stats, outfile = outfile, maskband = maskband, maskvalue = maskvalue, **kwargs)
+        return _compute_stats(self.data['filename'], band = band, bands = bands, stats = stats, outfile = outfile, maskband = maskband, maskvalue = maskvalue, maskbits = maskbits, maskfiles = _maskfiles(self.data), **kwargs)
 
-    def count_obs(self, njobs = 1, verbose = 0):
+    def count_obs(self, njobs = 1, verbose = 0, overview_level = None):
         '''
         Assigns the number of non-nodata pixels to the 'nobs' column of the (meta)dataframe
+        If overview_level is given, counts are estimated from overviews (see valid_pixels). Counts are cached per file and band in the calling process.
+        '''
+        fl = list(self.data['filename'])
+        # scan in parallel, then count from the (filled) cache of this process
+        batch_valid_pixels(fl, bands = list(range(1, self.profile['count'] + 1)), overview_level = overview_level, njobs = njobs, verbose = verbose)
+        self.data['nobs'] = [count_nobs(f, overview_level = overview_level) for f in fl]
+
+    def filter_valid(self, min_valid_fraction, band = 1, overview_level = -1, njobs = 1, verbose = 0):
         '''
-        self.data['nobs'] = Parallel(n_jobs = njobs, verbose = verbose)(delayed(count_nobs)(f) for f in self.data['filename'])
+        Drops files with less than min_valid_fraction valid pixels from the (meta)dataframe
+
+        Arguments
+        ---------
+        min_valid_fraction: minimum fraction (0-1) of valid (non-nodata) pixels
+        band:               band to scan [1]
+        overview_level:     estimate from this overview level (-1 = coarsest; None = full resolution) [-1]
+        njobs:              number of jobs (for parallel processing) [1]
+        verbose:            verbosity (0-100) [0]
+
+        Fractions are cached per file and assigned to the 'valid' column of the (meta)dataframe.
+        '''
+        self.data['valid'] = batch_valid_fraction(list(self.data['filename']), band = band, overview_level = overview_level, njobs = njobs, verbose = verbose)
+        self.data = self.data[self.data['valid'] >= min_valid_fraction].reset_index(drop = True)
+        if len(self.data) == 0:
+            raise ValueError("No files with at least {0} valid pixels.".format(min_valid_fraction))
+
+    def pipeline(self, band = 1):
+        '''
+        Starts a lazy chain of operations (subset, mask, band math, stats/trend) computed in a single pass per chunk
+
+        Arguments
+        ---------
+        band:       band used when no band math is given [1]
+
+        Returns: a Pipeline (see rasterstack.pipeline.Pipeline), e.g.:
+        rts.pipeline().subset(years = [2017]).mask(maskband = 5, maskbits = [3, 4]).normdiff(4, 3).compute_stats(stats = ['mean'])
+        '''
+        from .pipeline import Pipeline
+        return Pipeline(self, band = band)
 
 
 class SingleFileRasterStack(object):
@@ -84,123 +149,317 @@ class RasterTimeSeries(RasterStack):
     '''
     Arguments
     ---------
-    fl:    List of filenames pointing to rasters
-    dates: List of datetime.datetime objects corresponding to each file in fl
+    fl:         List of filenames pointing to rasters
+    dates:      List of datetime.datetime objects corresponding to each file in fl
+    maskfiles:  (optional) List of mask (e.g., QA) filenames corresponding to each file in fl
+    min_valid_fraction: (optional) drop files with a smaller fraction of valid pixels in band 1 (estimated from overviews, if available; see filter_valid)
+    categorical: (optional) rasters hold integer classes (e.g., land cover); compute_stats then returns class stats (see compute_stats) [False]
+    classes:    (optional) list of class values of a categorical series [all values of an 8-bit data type except nodata]
     
-    TODO: allow for single file (e.g., NETCDF4, GRD) to be read as multi-band time series raster
+    A time series stored in a single file is read with rasterstack.cube.CubeTimeSeries: a time-major Zarr cube, written with to_cube.
+    TODO: read other single-file time series (e.g., NETCDF4, GRD) into a CubeTimeSeries
     '''
-    def __init__(self, fl, dates):
+    def __init__(self, fl, dates, maskfiles = None, min_valid_fraction = None, categorical = False, classes = None):
         
         if len(dates) != len(fl):
             raise ValueError("dates should be the same length as fl")
 
-        RasterStack.__init__(self, fl)
-                      
-        self.data = self.data.assign(
-            date = dates,
-            year = [ int(datetime.strftime(d, "%Y")) for d in dates ],
-            month = [ int(datetime.strftime(d, "%m")) for d in dates ],
-            doy = [ int(datetime.strftime(d, "%j")) for d in dates ],
-        )
-        
-        self.data = self.data.assign(
-            season = [_get_season(d) for d in self.data['doy']],
-            quarter = [int(d / 92) + 1 for d in self.data['doy']]
-        )
-        
-        self.data.sort_values('date', inplace = True)
-        self.data.reset_index(drop = True, inplace = True)
+        RasterStack.__init__(self, fl, maskfiles = maskfiles)
+
+        self.categorical = categorical
+        self.classes = classes
+        if categorical and classes is None:
+            from .categorical import default_classes
+            self.classes = default_classes(self.profile['dtype'], self.profile['nodata'])
+
+        self.data = _date_metadata(self.data, dates)
+
+        if min_valid_fraction is not None:
+            self.filter_valid(min_valid_fraction)
         
         
-    def compute_stats(self, band = 1, months = None, years = None, doys = None, seasons = None, quarters = None, stats = ['nobs', 'mean', 'median', 'std'], outfile = None, maskband = None, maskvalue = 1, **kwargs):
+    def compute_stats(self, band = 1, months = None, years = None, doys = None, seasons = None, quarters = None, stats = None, outfile = None, maskband = None, maskvalue = None, maskbits = None, bands = None, **kwargs):
         '''
         Compute pixel-based descriptive stats
 
         Arguments
         ---------
         band:       band to open when computing stats
+        bands:      (optional) list of bands to compute stats for in a single pass (overrides band). See details.
         months:     list of months (integer 1-12) for monthly/seasonal subset [None]. See details for restrictions.
         years:      list of years for annual subset [None]
         doys:       list of days (1-366) for DOY subset [None]. See details for restrictions.
         seasons:    one of 'winter', 'spring', 'summer' or 'autumn' (defined for the Northern Hemisphere). See details for restrictions.
         quarters:   list of quarters between 1 and 4. See details for restrictions.
-        stats:      stats to be computed (must be one or more of ['nobs', 'mean', 'median', 'std']
-        maskband:   (optional) integer band number to be used for masking
-        maskvalue:  (optional) value in mask band to be masked (Default: 1)
-        outfile:    (optional) output filename (multi-band raster where number of bands = len(stats))
+        stats:      stats to be computed (must be one or more of ['nobs', 'mean', 'median', 'std'], or of ['nobs', 'mode', 'counts', 'frequency', 'transitions'] for a categorical series)
+                    [['nobs', 'mean', 'median', 'std'], or ['nobs', 'mode', 'transitions'] for a categorical series]
+        maskband:   (optional) integer band number to be used for masking (band in the mask files if maskfiles were given; Default: 1)
+        maskvalue:  (optional) value or list/set of values in mask band to be masked (Default: 1, unless maskbits is given)
+        maskbits:   (optional) list of bit positions in mask band to be masked (e.g., QA cloud, shadow, snow bits)
+        outfile:    (optional) output filename (multi-band raster where number of bands = len(stats), or len(bands) * len(stats))
         
         Keyword arguments (kwargs)
         --------------------------
         rchunk:     number of rows to process at a time [100]
         njobs:      number of jobs (for parallel processing) [1]
         verbose:    verbosity (0-100) [0]
+        backend:    'joblib' (process-based parallel chunks) or 'threads' (thread pool prefetching the next chunk while the current one is reduced) ['joblib']
+        mem_budget: (optional) memory budget (bytes, or e.g. '8G'); if given, rchunk and njobs (up to njobs, or all cores) are chosen from stack depth, width, bands and stats
         
         Details:
         --------
         The 'years' argument can be combined with other subsetting arguments to get (e.g.) all 1st quarter imagery for a given range of years. However, other sub-annual subsetting arguments cannot be used together (e.g., passing arguments to both 'months' and 'quarters' will return an error).
+        If bands is given, every requested band of each chunk is read with a single call per file, and a list (one item per band) of lists of stats is returned.
+        In the output file, stats are ordered by band, then by stat.
+        For a categorical series, files are read one at a time and class counts are accumulated per pixel (bands and backend are not supported):
+        'mode' is the most frequent class (the first class in case of ties; nodata where there are no valid observations, or, if nodata is not set or is a class,
+        the largest value of the data type that is not a class), 'counts' and 'frequency' have one band per class (in sorted order)
+        and 'transitions' is the number of changes of class between consecutive valid observations. Values that are not in classes are not counted.
         '''
+        if stats is None:
+            stats = ['nobs', 'mode', 'transitions'] if self.categorical else ['nobs', 'mean', 'median', 'std']
         if not isinstance(stats, list):
             stats = [stats]
+        
+        df = _subset_dates(self.data, months = months, years = years, doys = doys, seasons = seasons, quarters = quarters)
+
+        if self.categorical:
+            if bands is not None:
+                raise ValueError("bands is not supported for a categorical series")
+            return _compute_categorical(df['filename'], self.classes, band = band, stats = stats, outfile = outfile, maskband = maskband, maskvalue = maskvalue, maskbits = maskbits, maskfiles = _maskfiles(df), **kwargs)
+
         if not all(s in ['nobs', 'mean', 'median', 'std'] for s in stats):
             raise ValueError("'stats' must be one or more of ['nobs', 'mean', 'median', 'std']")
         
-        if sum([months != None, doys != None, quarters != None, seasons != None]) > 1:
-            raise ValueError("Only one of months, doys, quarters or seasons can be set.")
-        
-        df = self.data.assign(subset = [True] * len(self.data))
+        return _compute_stats(df['filename'], band = band, bands = bands, stats = stats, outfile = outfile, maskband = maskband, maskvalue = maskvalue, maskbits = maskbits, maskfiles = _maskfiles(df), **kwargs)
         
-        if seasons != None:
-            if not isinstance(seasons, list):
-                seasons = [seasons]
-            if not all(s in ['winter', 'spring', 'summer', 'autumn'] for s in seasons):
-                raise ValueError("'seasons' must be 1 or more of ['winter', 'spring', 'summer', 'autumn']")
-            for i in df.index:
-                if not df.loc[i, 'season'] in seasons:
-                    df.loc[i, 'subset'] = False
-        
-        if months != None:
-            if not isinstance(months, list):
-                months = [months]
-            if not all(m < 13 for m in months):
-                raise ValueError("Months must be between 1 and 12 inclusive")
-            for i in df.index:
-                if not df.loc[i, 'month'] in months:
-                    df.loc[i, 'subset'] = False
-        
-        if years != None:
-            if not isinstance(years, list):
-                years = [years]
-            for i in range(len(df)):
-                if not df.loc[i, 'year'] in years:
-                    df.loc[i, 'subset'] = False
-                    
-        if doys != None:
-            if not all(d < 367 for d in doys):
-                raise ValueError("DOYs must be between 1 and 366")
-            if not isinstance(doys, list):
-                raise ValueError("doys must be a list of DOYs")
-            for i in df.index:
-                if not df.loc[i, 'doy'] in doys:
-                    df.loc[i, 'subset'] = False
-
-        if quarters != None:
-            if not isinstance(quarters, list):
-                quarters = [quarters]
-            if not all(q in [1,2,3,4] for q in quarters):
-                raise ValueError("quarters must be a list containing one or more of [1,2,3,4]")
-            for i in df.index:
-                if not df.loc[i, 'quarter'] in quarters:
-                    df.loc[i, 'subset'] = False
-        
-        df = df[df['subset']]
+    def trend(self, band = 1, months = None, years = None, doys = None, seasons = None, quarters = None, outfile = None, maskband = None, maskvalue = None, maskbits = None, **kwargs):
+        '''
+        Compute pixel-based Theil-Sen slope (per year) and Mann-Kendall test
+
+        Arguments
+        ---------
+        band:       band to open when computing the trend
+        months, years, doys, seasons, quarters: temporal subset (see compute_stats)
+        outfile:    (optional) output filename (3-band float32 raster: slope, sign index, Z)
+        maskband:   (optional) integer band number to be used for masking
+        maskvalue:  (optional) value or list/set of values in mask band to be masked
+        maskbits:   (optional) list of bit positions in mask band to be masked
+
+        Keyword arguments (kwargs)
+        --------------------------
+        rchunk:     number of rows to process at a time [100]
+        njobs:      number of jobs (for parallel processing) [1]
+        nthreads:   number of OpenMP threads used by theilsen in each job [cores / njobs]
+        verbose:    verbosity (0-100) [0]
+        mem_budget: (optional) memory budget (bytes, or e.g. '8G'); if given, rchunk and njobs (up to njobs, or all cores) are chosen from stack depth and width
+
+        Returns: Theil-Sen slope, Mann-Kendall sign index and Z-statistic over the valid observations of each pixel. Pixels with fewer than 2 valid observations are NaN.
+        '''
+        df = _subset_dates(self.data, months = months, years = years, doys = doys, seasons = seasons, quarters = quarters)
+        if maskvalue is None and maskbits is None:
+            maskvalue = 1
+        maskfiles = _maskfiles(df) or [None] * len(df)
+
+        h = self.profile['height']
+        w = self.profile['width']
+        rchunk, njobs = _chunking(kwargs.pop('mem_budget', None), kwargs.pop('rchunk', None), kwargs.pop('njobs', None), len(df), w, h, kind = 'trend')
+        read = partial(_read_chunk, list(df['filename']), [band], maskband, maskvalue, maskbits, maskfiles, rchunk, w, h)
+
+        return _compute_trend(read, _decimal_years(df['date']), h, self.profile, outfile = outfile, rchunk = rchunk, njobs = njobs, **kwargs)
+
+    def rolling(self, window = 30, step = None, start = None, end = None, band = 1, months = None, years = None, doys = None, seasons = None, quarters = None, stats = ['nobs', 'mean', 'median', 'std'], outfile = None, maskband = None, maskvalue = None, maskbits = None, **kwargs):
+        '''
+        Compute pixel-based descriptive stats in rolling time windows
+
+        Arguments
+        ---------
+        window:     window length (days) [30]
+        step:       time (days) between the start of consecutive windows [window]
+        start:      (optional) datetime.datetime start of the first window [first date of the temporal subset]
+        end:        (optional) datetime.datetime; windows starting at or after end are not computed [windows starting after the last date of the temporal subset are not computed]
+        band:       band to open when computing stats
+        months, years, doys, seasons, quarters: temporal subset (see compute_stats)
+        stats:      stats to be computed (must be one or more of ['nobs', 'mean', 'median', 'std']
+        outfile:    (optional) output filename pattern, formatted with the start date of each window (e.g., 'stats_{0:%Y%j}.tif'); each file has len(stats) bands
+        maskband:   (optional) integer band number to be used for masking (band in the mask files if maskfiles were given)
+        maskvalue:  (optional) value or list/set of values in mask band to be masked (Default: 1, unless maskbits is given)
+        maskbits:   (optional) list of bit positions in mask band to be masked
+
+        Keyword arguments (kwargs)
+        --------------------------
+        rchunk:     number of rows to process at a time [100]
+        njobs:      number of jobs (for parallel processing) [1]
+        verbose:    verbosity (0-100) [0]
+        mem_budget: (optional) memory budget (bytes, or e.g. '8G'); if given, rchunk and njobs (up to njobs, or all cores) are chosen from stack depth, width, stats and number of windows
+
+        Returns: list of window start dates and a list (one item per window) of lists of stats
+
+        Details:
+        --------
+        A window starting at date d includes all observations from d (inclusive) to d + window days (exclusive).
+        Each chunk of rows is read once for all windows. nobs, mean and std are computed from cumulative sums along the time axis,
+        so overlapping windows do not add to the cost of reading or reducing them. The median is not incremental: it is recomputed
+        on the (in-memory) observations of every window, so with overlapping windows (step < window) its cost grows with window / step.
+        '''
+        if not isinstance(stats, list):
+            stats = [stats]
+        if not all(s in ['nobs', 'mean', 'median', 'std'] for s in stats):
+            raise ValueError("'stats' must be one or more of ['nobs', 'mean', 'median', 'std']")
+        if step is None:
+            step = window
+
+        df = _subset_dates(self.data, months = months, years = years, doys = doys, seasons = seasons, quarters = quarters)
+        if maskvalue is None and maskbits is None:
+            maskvalue = 1
+        maskfiles = _maskfiles(df) or [None] * len(df)
         if len(df) == 0:
-            raise ValueError("No data left after subsetting.")
-        
-        df.sort_values('date', inplace = True)
-        df.reset_index(inplace = True, drop = True)
-        
-        return _compute_stats(df['filename'], band = band, stats = stats, outfile = outfile, maskband = maskband, maskvalue = maskvalue, **kwargs)
-        
+            raise ValueError("No files in the temporal subset.")
+
+        if start is None:
+            start = df['date'].iloc[0]
+        # by default, a window may start on the last date, so that the last observations are not dropped
+        inclusive = end is None
+        if end is None:
+            end = df['date'].iloc[-1]
+        starts = []
+        while start < end or (inclusive and start == end) or len(starts) == 0:
+            starts.append(start)
+            start = start + timedelta(days = step)
+        a, b = _window_index(df['date'], starts, window)
+
+        h = self.profile['height']
+        w = self.profile['width']
+        # outputs of all windows are held in memory; cumulative sums are float64
+        rchunk, njobs = _chunking(kwargs.pop('mem_budget', None), kwargs.pop('rchunk', None), kwargs.pop('njobs', None), 7 * len(df), w, h, stats = stats * len(starts))
+        read = partial(_read_chunk, list(df['filename']), [band], maskband, maskvalue, maskbits, maskfiles, rchunk, w, h)
+
+        fn = partial(_rolling_chunk, read, a, b, stats, self.profile['nodata'], self.profile['dtype'])
+        verbose = kwargs.pop('verbose', 0)
+        if njobs > 1:
+            Z = Parallel(n_jobs = njobs, verbose = verbose)(delayed(fn)(i) for i in range(0, h, rchunk))
+        else:
+            Z = [fn(i) for i in range(0, h, rchunk)]
+
+        dtypeout = _stats_dtype(self.profile['dtype'])
+        out = [_stack_stats([z[k] for z in Z], stats, dtypeout) for k in range(len(starts))]
+
+        if outfile:
+            for k, d in enumerate(starts):
+                write_raster(outfile.format(d), np.stack(out[k]), self.profile)
+
+        return starts, out
+
+    def to_cube(self, outfile, band = 1, maskband = None, maskvalue = None, maskbits = None, **kwargs):
+        '''
+        Rewrites the time series into a time-major chunked cube (see rasterstack.cube.to_cube)
+
+        Returns: a CubeTimeSeries
+        '''
+        from .cube import to_cube, CubeTimeSeries
+        to_cube(list(self.data['filename']), list(self.data['date']), outfile, band = band, maskband = maskband, maskvalue = maskvalue, maskbits = maskbits, maskfiles = _maskfiles(self.data), **kwargs)
+        return CubeTimeSeries(outfile)
+
+    def gapfill(self, step = 16, dates = None, band = 1, method = 'linear', max_gap = None, maskband = None, maskvalue = None, maskbits = None):
+        '''
+        Gap-filled time series at a regular time step (see rasterstack.gapfill.GapFilledTimeSeries)
+
+        Arguments
+        ---------
+        step:       output time step (days), starting at the first date [16]
+        dates:      (optional) list of output datetime.datetime objects (overrides step)
+        band:       band to be filled [1]
+        method:     'linear' or 'nearest' ['linear']
+        max_gap:    (optional) maximum time (days) between the previous and next valid observations for a value to be filled [None]
+        maskband:   (optional) integer band number to be used for masking
+        maskvalue:  (optional) value or list/set of values in mask band to be masked
+        maskbits:   (optional) list of bit positions in mask band to be masked
+
+        Returns: a GapFilledTimeSeries, with compute_stats, trend and to_cube methods. Filling is done chunk by chunk when these are called.
+        '''
+        from .gapfill import GapFilledTimeSeries, regular_dates
+        if dates is None:
+            dates = regular_dates(self.data['date'].iloc[0], self.data['date'].iloc[-1], step = step)
+        return GapFilledTimeSeries(self, dates, band = band, method = method, max_gap = max_gap, maskband = maskband, maskvalue = maskvalue, maskbits = maskbits)
+
+    def composite(self, bands, method = 'medoid', months = None, years = None, doys = None, seasons = None, quarters = None, outfile = None, maskband = None, maskvalue = None, maskbits = None, red = None, nir = None, score = None, **kwargs):
+        '''
+        Best-available-pixel composite: one observation (with all of its bands) is selected for each pixel
+
+        Arguments
+        ---------
+        bands:      list of bands to composite
+        method:     'medoid', 'maxndvi' or 'score'. See details. ['medoid']
+        months, years, doys, seasons, quarters: temporal subset (see compute_stats)
+        outfile:    (optional) output filename (multi-band raster where number of bands = len(bands))
+        maskband:   (optional) integer band number to be used for masking (band in the mask files if maskfiles were given)
+        maskvalue:  (optional) value or list/set of values in mask band to be masked (Default: 1, unless maskbits is given)
+        maskbits:   (optional) list of bit positions in mask band to be masked
+        red, nir:   red and near-infrared band numbers (must be in bands; 'maxndvi' only)
+        score:      function returning a (time, rows, cols) score (higher is better) from a (time, bands, rows, cols) float32 chunk and a list of dates ('score' only)
+
+        Keyword arguments (kwargs)
+        --------------------------
+        rchunk:     number of rows to process at a time [100]
+        njobs:      number of jobs (for parallel processing) [1]
+        nthreads:   number of OpenMP threads used by the selection kernel in each job [cores / njobs]
+        verbose:    verbosity (0-100) [0]
+        mem_budget: (optional) memory budget (bytes, or e.g. '8G'); if given, rchunk and njobs (up to njobs, or all cores) are chosen from stack depth, width and bands
+
+        Returns: composite (array of shape (len(bands), rows, cols), with nodata where no valid observation is available) and date (decimal year, float32) of the selected observation.
+        If the series has no nodata value, such pixels get a value not used by the composite (see categorical.flag_value), which is written as the nodata value of outfile.
+
+        Details:
+        --------
+        An observation is valid if none of its bands is masked or nodata.
+        'medoid' selects the valid observation with the smallest sum of (Euclidean, across bands) distances to the other valid observations of the pixel.
+        'maxndvi' selects the valid observation with the highest NDVI; 'score' the valid observation with the highest score.
+        Selection runs in a compiled (OpenMP) kernel, and all bands of each chunk are read with a single call per file.
+        '''
+        from .composite import composite
+        if not isinstance(bands, list):
+            bands = [bands]
+        if maskband in bands and not 'maskfile' in self.data:
+            raise ValueError("band numbers and maskband number should not be the same.")
+        if method == 'maxndvi' and not (red in bands and nir in bands):
+            raise ValueError("red and nir bands must be in bands")
+
+        df = _subset_dates(self.data, months = months, years = years, doys = doys, seasons = seasons, quarters = quarters)
+        if maskvalue is None and maskbits is None:
+            maskvalue = 1
+        maskfiles = _maskfiles(df) or [None] * len(df)
+
+        h = self.profile['height']
+        w = self.profile['width']
+        rchunk, njobs = _chunking(kwargs.pop('mem_budget', None), kwargs.pop('rchunk', None), kwargs.pop('njobs', None), len(df), w, h, nbands = len(bands), stats = ['mean'])
+        nthreads = kwargs.pop('nthreads', None) or omp_threads(njobs)
+        read = partial(_read_chunk, list(df['filename']), bands, maskband, maskvalue, maskbits, maskfiles, rchunk, w, h)
+
+        comp, idx = composite(read, h, list(df['date']), method = method,
+            red = bands.index(red) if red in bands else None, nir = bands.index(nir) if nir in bands else None,
+            score = score, nodatavalue = self.profile['nodata'], rchunk = rchunk, njobs = njobs, nthreads = nthreads, **kwargs)
+
+        t = _decimal_years(df['date']).astype(np.float32)
+        date = np.where(idx >= 0, t[np.maximum(idx, 0)], np.nan).astype(np.float32)
+
+        profile = self.profile
+        missing = np.isnan(comp)
+        if profile['nodata'] is None and missing.any():
+            # without a nodata value, pixels without valid observations get a value that no composite pixel has
+            from .categorical import flag_value
+            try:
+                profile = dict(profile, nodata = flag_value(profile['dtype'], np.unique(comp[~missing])))
+            except ValueError:
+                raise ValueError("the composite uses every value of {0}; set a nodata value to flag pixels without valid observations".format(profile['dtype']))
+        if profile['nodata'] is not None:
+            comp[missing] = profile['nodata']
+        comp = comp.astype(profile['dtype'])
+
+        if outfile:
+            write_raster(outfile, comp, profile)
+
+        return comp, date
+
     def subset_by_date(self, date, inplace = False):
         pass
         
@@ -214,25 +473,48 @@ class RasterTimeSeries(RasterStack):
         
 ## helper functions
     
-def _linestats(fl, stats, band, maskband, maskvalue, rchunk, w, h, nodatavalue, l):
+def _chunksize(l, rchunk, h):
     if (l + rchunk) >= h:
-        chunk = h - l
+        return h - l
     else:
-        chunk = rchunk
+        return rchunk
+
+def _maskfiles(df):
+    if 'maskfile' in df:
+        return list(df['maskfile'])
+    else:
+        return None
+
+def _read_into(f, bands, maskband, maskvalue, maskbits, maskfile, win, out):
+    '''
+    Reads a window of one or more bands into a pre-allocated float32 array of shape (bands, rows, cols), masking as needed.
+    All bands (and the mask band, if it is in the same file) are read in a single multi-band read.
+    '''
+    with rasterio.open(f) as src:
+        if maskband and not maskfile:
+            x = src.read(list(bands) + [maskband], window = win)
+            np.copyto(out, x[:-1], casting = 'unsafe')
+            qa = x[-1]
+        else:
+            src.read(list(bands), window = win, out = out, out_dtype = np.float32)
+
+    if maskfile:
+        with rasterio.open(maskfile) as src:
+            qa = src.read(maskband or 1, window = win)
     
-    win = ((l, l + chunk), (None, None))
-    x = np.zeros((len(fl), chunk, w), dtype = np.float32)
-    for i, f in enumerate(fl):
-        with rasterio.open(f) as src:
-            x[i,:,:] = src.read(band, window = win).astype(np.float32)
-            profile = src.profile
-            if maskband:
-                mask = src.read(maskband, window = win)
-                x[i][np.where(mask == maskvalue)] = np.nan
+    if maskband or maskfile:
+        apply_mask(out, qa_mask(qa, values = maskvalue, bits = maskbits))
 
+def _reduce_chunk(x, stats, nodatavalue, dtype):
+    '''
+    Reduces a (time, rows, cols) float32 chunk along axis 0. Note that x is modified in place.
+    '''
+    chunk = x.shape[1]
+    w = x.shape[2]
 
-    x[np.where(x == nodatavalue)] = np.nan
-    x[np.where(np.isinf(x))] = np.nan
+    if nodatavalue is not None:
+        apply_mask(x, x == nodatavalue)
+    apply_mask(x, np.isinf(x))
     
     xco = None
     xme = None
@@ -247,46 +529,297 @@ def _linestats(fl, stats, band, maskband, maskvalue, rchunk, w, h, nodatavalue,
     if 'mean' in stats:
         xme = np.nanmean(x, axis = 0)
         xme[np.isnan(xme)] = nodatavalue
-        xme = xme.reshape((chunk, w)).astype(profile['dtype'])
+        xme = xme.reshape((chunk, w)).astype(dtype)
     
     # median
     if 'median' in stats:
         xmd = np.nanmedian(x, axis = 0)
         xmd[np.isnan(xmd)] = nodatavalue
-        xmd = xmd.reshape((chunk, w)).astype(profile['dtype'])
+        xmd = xmd.reshape((chunk, w)).astype(dtype)
 
     # std
     if 'std' in stats:
         xst = np.nanstd(x, axis = 0)
         xst[np.isnan(xst)] = nodatavalue
-        xst = xst.reshape((chunk, w)).astype(profile['dtype'])
+        xst = xst.reshape((chunk, w)).astype(dtype)
 
     return xco, xme, xmd, xst
+
+def _read_chunk(fl, bands, maskband, maskvalue, maskbits, maskfiles, rchunk, w, h, l):
+    '''
+    Reads rows l to l + rchunk of each file into a float32 array of shape (files, bands, rows, cols)
+    '''
+    chunk = _chunksize(l, rchunk, h)
+
+    win = ((l, l + chunk), (None, None))
+    x = np.zeros((len(fl), len(bands), chunk, w), dtype = np.float32)
+    for i, f in enumerate(fl):
+        _read_into(f, bands, maskband, maskvalue, maskbits, maskfiles[i], win, x[i])
+
+    return x
+
+def _linestats(fl, stats, bands, maskband, maskvalue, maskbits, maskfiles, rchunk, w, h, nodatavalue, dtype, l):
+    '''
+    Returns a list of stats (as returned by _reduce_chunk), one per band
+    '''
+    x = _read_chunk(fl, bands, maskband, maskvalue, maskbits, maskfiles, rchunk, w, h, l)
+
+    return [_reduce_chunk(x[:,k], stats, nodatavalue, dtype) for k in range(len(bands))]
+
+def _linetrend(read, t, nodatavalue, nthreads, l):
+    '''
+    Theil-Sen/Mann-Kendall test on one chunk. read(l) should return a (time, 1, rows, cols) array.
+    Missing (masked or nodata) observations are skipped; pixels with fewer than 2 valid observations are NaN (slope, Z) and 0 (sign index).
+    '''
+    x = read(l)[:,0]
+    if nodatavalue is not None:
+        apply_mask(x, x == nodatavalue)
+    apply_mask(x, np.isinf(x))
+
+    return theilsen(x, t, nthreads = nthreads)
+
+def _compute_trend(read, t, h, profile, outfile = None, rchunk = 100, njobs = 1, nthreads = None, verbose = 0):
+    '''
+    Chunked Theil-Sen/Mann-Kendall test
+    '''
+    if nthreads is None:
+        # don't oversubscribe cores with OpenMP threads inside joblib workers
+        nthreads = omp_threads(njobs)
+    fn = partial(_linetrend, read, t, profile['nodata'], nthreads)
+    if njobs > 1:
+        Z = Parallel(n_jobs = njobs, verbose = verbose)(delayed(fn)(i) for i in range(0, h, rchunk))
+    else:
+        Z = [fn(i) for i in range(0, h, rchunk)]
+
+    ts = np.concatenate([z[0] for z in Z], axis = 0)
+    mk = np.concatenate([z[1] for z in Z], axis = 0)
+    mkz = np.concatenate([z[2] for z in Z], axis = 0)
+
+    if outfile:
+        write_raster(outfile, np.stack([ts, mk, mkz]).astype(np.float32), dict(profile, nodata = np.nan))
+
+    return ts, mk, mkz
+
+def _window_index(dates, starts, window):
+    '''
+    Returns the first (a) and last + 1 (b) indices of the (sorted) dates in each window
+    '''
+    t = np.array(list(dates), dtype = 'datetime64[s]')
+    s = np.array(list(starts), dtype = 'datetime64[s]')
+    a = np.searchsorted(t, s, side = 'left')
+    b = np.searchsorted(t, s + np.timedelta64(int(window * 86400), 's'), side = 'left')
+    return a, b
+
+def _rolling_chunk(read, a, b, stats, nodatavalue, dtype, l):
+    '''
+    Returns a list of stats (as returned by _reduce_chunk), one per window, from cumulative sums along the time axis
+    '''
+    x = read(l)[:,0]
+    n, chunk, w = x.shape
+    if nodatavalue is not None:
+        apply_mask(x, x == nodatavalue)
+    apply_mask(x, np.isinf(x))
+    valid = np.isfinite(x)
+
+    # values are shifted by the first valid observation of each pixel to limit cancellation in the sums of squares
+    shift = np.take_along_axis(x, valid.argmax(axis = 0)[np.newaxis], axis = 0)[0]
+    shift[np.isnan(shift)] = 0
+    y = np.where(valid, x - shift, 0).astype(np.float64)
+
+    cco = np.zeros((n + 1, chunk, w), dtype = np.int32)
+    np.cumsum(valid, axis = 0, out = cco[1:])
+    csum = np.zeros((n + 1, chunk, w), dtype = np.float64)
+    np.cumsum(y, axis = 0, out = csum[1:])
+    if 'std' in stats:
+        np.multiply(y, y, out = y)
+        csq = np.zeros((n + 1, chunk, w), dtype = np.float64)
+        np.cumsum(y, axis = 0, out = csq[1:])
+
+    Z = []
+    for i, j in zip(a, b):
+        xco = None
+        xme = None
+        xmd = None
+        xst = None
+
+        nobs = cco[j] - cco[i]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            m = (csum[j] - csum[i]) / nobs
+            if 'std' in stats:
+                xst = np.sqrt(np.maximum((csq[j] - csq[i]) / nobs - m * m, 0))
+                xst[nobs == 0] = nodatavalue
+                xst = xst.astype(dtype)
+
+        if 'nobs' in stats:
+            xco = nobs.astype(np.int16)
+        if 'mean' in stats:
+            xme = m + shift
+            xme[nobs == 0] = nodatavalue
+            xme = xme.astype(dtype)
+        if 'median' in stats:
+            if j > i:
+                xmd = np.nanmedian(x[i:j], axis = 0)
+            else:
+                xmd = np.full((chunk, w), np.nan, dtype = np.float32)
+            xmd[np.isnan(xmd)] = nodatavalue
+            xmd = xmd.astype(dtype)
+
+        Z.append((xco, xme, xmd, xst))
+
+    return Z
+
+def _prefetch_linestats(fl, stats, bands, maskband, maskvalue, maskbits, maskfiles, rchunk, w, h, nodatavalue, dtype, nthreads = 1):
+    '''
+    Pipelined alternative to _linestats: a thread pool reads (and decompresses) the next chunk
+    into one of two alternating buffers while the current chunk is being reduced.
+    GDAL releases the GIL during reads, so I/O and computation overlap without
+    the pickling and per-process memory of the joblib backend.
+    '''
+    starts = list(range(0, h, rchunk))
+    buffers = [np.zeros((len(fl), len(bands), rchunk, w), dtype = np.float32) for i in range(2)]
+
+    def submit(pool, j):
+        l = starts[j]
+        chunk = _chunksize(l, rchunk, h)
+        win = ((l, l + chunk), (None, None))
+        x = buffers[j % 2][:, :, :chunk, :]
+        futures = [pool.submit(_read_into, f, bands, maskband, maskvalue, maskbits, maskfiles[i], win, x[i]) for i, f in enumerate(fl)]
+        return x, futures
+
+    Z = []
+    with ThreadPoolExecutor(max_workers = max(1, nthreads)) as pool:
+        pending = submit(pool, 0)
+        for j in range(len(starts)):
+            x, futures = pending
+            for fut in futures:
+                fut.result()
+            # queue up the next chunk before reducing the current one
+            if j + 1 < len(starts):
+                pending = submit(pool, j + 1)
+            Z.append([_reduce_chunk(x[:,k], stats, nodatavalue, dtype) for k in range(len(bands))])
+
+    return Z
     
-def _compute_stats(fl, stats = ['nobs', 'mean', 'median', 'std'], band = 1, maskband = None, maskvalue = None, outfile = None, rchunk = 100, njobs = 1, verbose = 0):
-    
+def _compute_stats(fl, stats = ['nobs', 'mean', 'median', 'std'], band = 1, bands = None, maskband = None, maskvalue = None, maskbits = None, maskfiles = None, outfile = None, rchunk = None, njobs = None, verbose = 0, backend = 'joblib', mem_budget = None):
+    '''
+    If bands is given, all bands are read in one pass and a list (one item per band) of lists of stats is returned
+    '''
+    multiband = bands is not None
+    if not multiband:
+        bands = [band]
+    elif not isinstance(bands, list):
+        bands = [bands]
+    if maskband in bands and not any(maskfiles or []):
+        raise ValueError("band numbers and maskband number should not be the same.")
+
     if not equalExtents(fl):
         raise ValueError("Rasters do not have aligned extents.")
     if not isinstance(stats, list):
         stats = [stats]
+    if maskvalue is None and maskbits is None:
+        maskvalue = 1
+    if maskfiles is None:
+        maskfiles = [None] * len(fl)
+    elif len(maskfiles) != len(fl):
+        raise ValueError("maskfiles should be the same length as fl")
+    if not backend in ['joblib', 'threads']:
+        raise ValueError("backend must be one of ['joblib', 'threads']")
 
     with rasterio.open(fl[0]) as src:
         profile = src.profile
     w = profile['width']
     h = profile['height']
     nodatavalue = profile['nodata']
-       
-    fn = partial(_linestats, fl, stats, band, maskband, maskvalue, rchunk, w, h, nodatavalue)
-    if njobs > 1:
-        Z = Parallel(n_jobs = njobs, verbose = verbose)(delayed(fn)(i) for i in range(0, h, rchunk))
-    else:
-        Z = [fn(i) for i in range(0, h, rchunk)]
+    rchunk, njobs = _chunking(mem_budget, rchunk, njobs, len(fl), w, h, nbands = len(bands), stats = stats, backend = backend)
     
-    if profile['dtype'] in [np.uint8, rasterio.uint8]:
-        dtypeout = np.int16
+    if backend == 'threads':
+        Z = _prefetch_linestats(list(fl), stats, bands, maskband, maskvalue, maskbits, list(maskfiles), rchunk, w, h, nodatavalue, profile['dtype'], nthreads = njobs)
     else:
-        dtypeout = profile['dtype']
+        fn = partial(_linestats, list(fl), stats, bands, maskband, maskvalue, maskbits, list(maskfiles), rchunk, w, h, nodatavalue, profile['dtype'])
+        if njobs > 1:
+            Z = Parallel(n_jobs = njobs, verbose = verbose)(delayed(fn)(i) for i in range(0, h, rchunk))
+        else:
+            Z = [fn(i) for i in range(0, h, rchunk)]
     
+    dtypeout = _stats_dtype(profile['dtype'])
+    
+    out = [_stack_stats([z[k] for z in Z], stats, dtypeout) for k in range(len(bands))]
+
+    if outfile:
+        write_raster(outfile, np.stack([o for band_out in out for o in band_out]), profile)
+
+    if multiband:
+        return out
+    else:
+        return out[0]
+
+def _read_file_chunk(fl, band, maskband, maskvalue, maskbits, maskfiles, rchunk, w, h, i, l):
+    '''
+    Reads rows l to l + rchunk of band of file i into a float32 array of shape (rows, cols)
+    '''
+    chunk = _chunksize(l, rchunk, h)
+
+    x = np.zeros((1, chunk, w), dtype = np.float32)
+    _read_into(fl[i], [band], maskband, maskvalue, maskbits, maskfiles[i], ((l, l + chunk), (None, None)), x)
+
+    return x[0]
+
+def _compute_categorical(fl, classes, stats = ['nobs', 'mode', 'transitions'], band = 1, maskband = None, maskvalue = None, maskbits = None, maskfiles = None, outfile = None, rchunk = None, njobs = None, verbose = 0, mem_budget = None):
+    '''
+    Class stats (see rasterstack.categorical.categorical_stats), streaming one file at a time
+    '''
+    from .categorical import categorical_stats, flag_value
+
+    if maskband == band and not any(maskfiles or []):
+        raise ValueError("band numbers and maskband number should not be the same.")
+    if len(fl) == 0:
+        raise ValueError("No files in the (subset) time series.")
+    if not equalExtents(fl):
+        raise ValueError("Rasters do not have aligned extents.")
+    if maskvalue is None and maskbits is None:
+        maskvalue = 1
+    if maskfiles is None:
+        maskfiles = [None] * len(fl)
+    elif len(maskfiles) != len(fl):
+        raise ValueError("maskfiles should be the same length as fl")
+
+    with rasterio.open(fl[0]) as src:
+        profile = src.profile
+    w = profile['width']
+    h = profile['height']
+    rchunk, njobs = _chunking(mem_budget, rchunk, njobs, len(fl), w, h, stats = stats, kind = 'categorical', nclasses = len(set(classes)))
+
+    # pixels without valid observations must not get a class as their mode
+    if 'mode' in stats and (profile['nodata'] is None or profile['nodata'] in classes):
+        profile = dict(profile, nodata = flag_value(profile['dtype'], classes))
+
+    read = partial(_read_file_chunk, list(fl), band, maskband, maskvalue, maskbits, list(maskfiles), rchunk, w, h)
+    out = categorical_stats(read, len(fl), h, classes, stats = stats, nodatavalue = profile['nodata'], dtype = profile['dtype'], rchunk = rchunk, njobs = njobs, verbose = verbose)
+
+    if outfile:
+        dtypeout = np.result_type(*out)
+        write_raster(outfile, np.concatenate([o.reshape((-1, h, w)).astype(dtypeout) for o in out]), profile)
+
+    return out
+
+def _chunking(mem_budget, rchunk, njobs, n, w, h, **kwargs):
+    '''
+    Returns (rchunk, njobs): chosen from the memory budget if given, otherwise the defaults (100, 1)
+    '''
+    if mem_budget is None:
+        return (100 if rchunk is None else rchunk), (1 if njobs is None else njobs)
+    return auto_chunking(mem_budget, n, w, h, njobs = njobs, **kwargs)
+
+def _stats_dtype(dtype):
+    if dtype in [np.uint8, rasterio.uint8]:
+        return np.int16
+    else:
+        return dtype
+
+def _stack_stats(Z, stats, dtypeout):
+    '''
+    Concatenates per-chunk (nobs, mean, median, std) tuples into full arrays
+    '''
     # returned stats in order requested
     out = []
     for s in stats:
@@ -298,18 +831,101 @@ def _compute_stats(fl, stats = ['nobs', 'mean', 'median', 'std'], band = 1, mask
             out.append(np.concatenate([z[2] for z in Z], axis = 0).astype(dtypeout))
         elif s == 'std':
             out.append(np.concatenate([z[3] for z in Z], axis = 0).astype(dtypeout))
+    return out
+
+def _subset_dates(data, months = None, years = None, doys = None, seasons = None, quarters = None):
+    '''
+    Returns the rows of a (meta)dataframe with date columns matching the temporal subset
+    '''
+    if sum([months != None, doys != None, quarters != None, seasons != None]) > 1:
+        raise ValueError("Only one of months, doys, quarters or seasons can be set.")
     
-    if outfile:
-        if len(stats) == 1:
-            z = out[0].reshape((1, out.shape[0], out.shape[1]))
-        else:
-            z = np.stack(out)
-        profile.update(count = len(stats), dtype = dtypeout, compress = 'lzw')
-        with rasterio.open(outfile, 'w', **profile) as dst:
-            dst.write(z)
+    df = data.assign(subset = [True] * len(data))
+    
+    if seasons != None:
+        if not isinstance(seasons, list):
+            seasons = [seasons]
+        if not all(s in ['winter', 'spring', 'summer', 'autumn'] for s in seasons):
+            raise ValueError("'seasons' must be 1 or more of ['winter', 'spring', 'summer', 'autumn']")
+        for i in df.index:
+            if not df.loc[i, 'season'] in seasons:
+                df.loc[i, 'subset'] = False
+    
+    if months != None:
+        if not isinstance(months, list):
+            months = [months]
+        if not all(m < 13 for m in months):
+            raise ValueError("Months must be between 1 and 12 inclusive")
+        for i in df.index:
+            if not df.loc[i, 'month'] in months:
+                df.loc[i, 'subset'] = False
+    
+    if years != None:
+        if not isinstance(years, list):
+            years = [years]
+        for i in range(len(df)):
+            if not df.loc[i, 'year'] in years:
+                df.loc[i, 'subset'] = False
+                
+    if doys != None:
+        if not all(d < 367 for d in doys):
+            raise ValueError("DOYs must be between 1 and 366")
+        if not isinstance(doys, list):
+            raise ValueError("doys must be a list of DOYs")
+        for i in df.index:
+            if not df.loc[i, 'doy'] in doys:
+                df.loc[i, 'subset'] = False
+
+    if quarters != None:
+        if not isinstance(quarters, list):
+            quarters = [quarters]
+        if not all(q in [1,2,3,4] for q in quarters):
+            raise ValueError("quarters must be a list containing one or more of [1,2,3,4]")
+        for i in df.index:
+            if not df.loc[i, 'quarter'] in quarters:
+                df.loc[i, 'subset'] = False
+    
+    df = df[df['subset']]
+    if len(df) == 0:
+        raise ValueError("No data left after subsetting.")
+    
+    df.sort_values('date', inplace = True)
+    df.reset_index(inplace = True, drop = True)
+
+    return df
+
+def _date_metadata(df, dates):
+    '''
+    Adds date columns to a (meta)dataframe and sorts it by date
+    '''
+    df = df.assign(
+        date = dates,
+        year = [ int(datetime.strftime(d, "%Y")) for d in dates ],
+        month = [ int(datetime.strftime(d, "%m")) for d in dates ],
+        doy = [ int(datetime.strftime(d, "%j")) for d in dates ],
+    )
+
+    df = df.assign(
+        season = [_get_season(d) for d in df['doy']],
+        quarter = [int(d / 92) + 1 for d in df['doy']]
+    )
+
+    df.sort_values('date', inplace = True)
+    df.reset_index(drop = True, inplace = True)
+
+    return df
+
+def _decimal_years(dates):
+    '''
+    Converts datetimes to decimal years (e.g., for trend slopes in units per year)
+    '''
+    t = []
+    for d in dates:
+        start = datetime(d.year, 1, 1)
+        end = datetime(d.year + 1, 1, 1)
+        t.append(d.year + (d - start).total_seconds() / (end - start).total_seconds())
+    return np.array(t, dtype = np.float64)
 
-    return out
- 
 def _get_season(doy):
     if doy >= 355 or doy < 81:
         return 'winter'
@@ -335,8 +951,9 @@ def _linestats_single(infile, stats, rchunk, w, h, nodatavalue, l):
         win = ((l, l + chunk), (None, None))
         x = src.read(window = win).astype(np.float32)
 
-    x[np.where(x == nodatavalue)] = np.nan
-    x[np.where(np.isinf(x))] = np.nan
+    if nodatavalue is not None:
+        apply_mask(x, x == nodatavalue)
+    apply_mask(x, np.isinf(x))
     
     xco = None
     xme = None
@@ -383,30 +1000,11 @@ def _compute_stats_single(infile, stats = ['nobs', 'mean', 'median', 'std'], out
     else:
         Z = [fn(i) for i in range(0, h, rchunk)]
     
-    if profile['dtype'] in [np.uint8, rasterio.uint8]:
-        dtypeout = np.int16
-    else:
-        dtypeout = profile['dtype']
+    dtypeout = _stats_dtype(profile['dtype'])
     
-    # returned stats in order requested
-    out = []
-    for s in stats:
-        if s == 'nobs':
-            out.append(np.concatenate([z[0] for z in Z], axis = 0).astype(dtypeout))
-        elif s == 'mean':
-            out.append(np.concatenate([z[1] for z in Z], axis = 0).astype(dtypeout))
-        elif s == 'median':
-            out.append(np.concatenate([z[2] for z in Z], axis = 0).astype(dtypeout))
-        elif s == 'std':
-            out.append(np.concatenate([z[3] for z in Z], axis = 0).astype(dtypeout))
+    out = _stack_stats(Z, stats, dtypeout)
     
     if outfile:
-        if len(stats) == 1:
-            z = out.reshape((1, out.shape[0], out.shape[1]))
-        else:
-            z = np.stack(out)
-        profile.update(count = len(stats), dtype = dtypeout, compress = 'lzw')
-        with rasterio.open(outfile, 'w', **profile) as dst:
-            dst.write(z)
+        write_raster(outfile, np.stack(out), profile)
 
     return out
\ No newline at end of file
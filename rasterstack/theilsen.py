@@ -0,0 +1,81 @@
+'''
+Pixelwise Theil-Sen slope and Mann-Kendall test (compiled OpenMP kernel, with a vectorized NumPy fallback)
+'''
+import warnings
+import numpy as np
+
+try:
+    from ._theilsen import theilsen as _theilsen_c
+except ImportError:
+    _theilsen_c = None
+
+# maximum number of (pair, pixel) values held at a time by the NumPy fallback
+_BLOCK = 2 ** 24
+
+
+def theilsen(arr, x = None, nthreads = -1):
+    '''
+    Returns the Theil-Sen slope, Mann-Kendall sign index and Z-statistic along axis 0 of input array.
+
+    Args:
+    =====
+    arr:        Input 3-D array
+    x:          Independent variable array. Default: array indexed along axis 0 of arr.
+    nthreads:   Number of threads to use (Default: all; ignored by the NumPy fallback)
+
+    Returns:    2-D numpy arrays of the Theil-Sen slope (float64), Mann-Kendall sign index (int16) and Z-statistic (float64)
+
+    Missing (NaN) observations are skipped: pairs with a missing value are left out, and Var(S) uses the number of valid observations of each pixel.
+    Pixels with fewer than 2 valid observations are NaN (slope, Z) and 0 (sign index).
+
+    The compiled extension (rasterstack._theilsen) is used if it was built; otherwise a (slower) vectorized NumPy version gives the same results.
+    '''
+    if x is not None and np.asarray(x).shape[0] != arr.shape[0]:
+        raise ValueError("Independent variable array must have the same shape as axis 0 of dependent array")
+    if _theilsen_c is not None:
+        return _theilsen_c(arr, x, nthreads = -1 if nthreads is None else nthreads)
+    warnings.warn("rasterstack._theilsen was not built; using the (slower) NumPy version of theilsen", RuntimeWarning)
+    return _theilsen_numpy(arr, x)
+
+def _theilsen_numpy(arr, x = None):
+    n, h, w = arr.shape
+    if x is None:
+        x = np.arange(n)
+    x = np.asarray(x, dtype = np.float64)
+    y = arr.reshape((n, h * w)).astype(np.float64)
+
+    i, j = np.triu_indices(n, 1)
+    dx = (x[j] - x[i])[:, np.newaxis]
+    block = max(1, _BLOCK // max(1, len(i)))
+
+    ts = np.full(h * w, np.nan, dtype = np.float64)
+    S = np.zeros(h * w, dtype = np.float64)
+    m = np.isfinite(y).sum(axis = 0)
+    valid = m > 1
+    for p in range(0, h * w, block):
+        # pairs with a missing (NaN) observation are skipped
+        dy = y[j, p:p + block] - y[i, p:p + block]
+        v = valid[p:p + block]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            ts[p:p + block][v] = np.nanmedian(dy[:, v] / dx, axis = 0)
+        S[p:p + block] = np.nansum(np.sign(dy), axis = 0)
+
+    # tie correction: sum of t (t - 1) (2t + 5) over groups of t tied values = sum of (t - 1) (2t + 5) over values
+    # (NaNs are sorted last and never equal, so each is a group of 1 and adds nothing)
+    ys = np.sort(y, axis = 0)
+    k = np.arange(n)[:, np.newaxis]
+    start = np.ones(ys.shape, dtype = bool)
+    start[1:] = ys[1:] != ys[:-1]
+    first = np.maximum.accumulate(np.where(start, k, 0), axis = 0)
+    end = np.ones(ys.shape, dtype = bool)
+    end[:-1] = start[1:]
+    last = np.minimum.accumulate(np.where(end, k, n - 1)[::-1], axis = 0)[::-1]
+    t = (last - first + 1).astype(np.float64)
+    ties = ((t - 1) * (2 * t + 5)).sum(axis = 0)
+
+    varS = (m * (m - 1.) * (2 * m + 5.) - ties) / 18.
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        Z = np.where(S > 0, (S - 1) / np.sqrt(varS), np.where(S < 0, (S + 1) / np.sqrt(varS), 0))
+    Z[~valid] = np.nan
+
+    return ts.reshape((h, w)), S.reshape((h, w)).astype(np.int16), Z.reshape((h, w))
@@ -3,11 +3,16 @@ Functions for tiling rasters
 '''
 import rasterio
 import numpy as np
+import os
+from affine import Affine
 from joblib import Parallel, delayed
 from functools import partial
 from collections import OrderedDict
 from pandas import DataFrame
 
+from .writer import write_raster
+from .warp import warp
+
 def imageExtent(f):
     '''
     f: single raster filename
@@ -32,7 +37,7 @@ def imageCRS(f):
     returns a crs string
     '''
     with rasterio.open(f) as src:
-        crs = src.profile['crs']['init']
+        crs = src.crs.to_string()
     
     return crs
     
@@ -85,7 +90,7 @@ def unionExtent(fl, njobs = 1, verbose = 0):
     return xmin, ymin, xmax, ymax
     
 
-def cropToExtent(f, targ_e, res = 30, outdir = None, suffix = 'crop', check_if_empty = False, crs = None):
+def cropToExtent(f, targ_e, res = 30, outdir = None, suffix = 'crop', check_if_empty = False, crs = None, resampling = 'nearest'):
     '''
     Arguments
     ---------
@@ -96,12 +101,18 @@ def cropToExtent(f, targ_e, res = 30, outdir = None, suffix = 'crop', check_if_e
     suffix:         filename suffix if writing to file ['crop']
     check_if_empty: avoid writing if no valid data [False]
     crs:            coordinate reference system; If None, this will be read using rasterio
+    resampling:     'nearest' or 'bilinear' ['nearest']
+
+    Details:
+    --------
+    The source -> target pixel map is computed once per (source grid, target grid) and cached (see rasterstack.warp),
+    so cropping scenes that share a grid (e.g., one path/row) onto the same tile only costs a gather per scene.
     '''
     with rasterio.open(f) as src:
         src_profile = src.profile
         src_aff = src.profile['transform']
-        src_srs = src.profile['crs']['init']
-        targ_srs = src.profile['crs']['init']
+        src_srs = src.crs
+        targ_srs = src.crs
         x = src.read()
 
     if crs is not None:
@@ -115,15 +126,12 @@ def cropToExtent(f, targ_e, res = 30, outdir = None, suffix = 'crop', check_if_e
     else:
         targ_h = int(targ_h)
         targ_w = int(targ_w)
-    targ_shape = (src_profile['count'], targ_h, targ_w)
-    targ = np.zeros(targ_shape, dtype = src_profile['dtype'])
-    
     targ_aff = Affine(
         res, 0, targ_e[0],
         0, -1*res, targ_e[3]
     )
     
-    reproject(x, targ, src_transform = src_aff, dst_transform = targ_aff, src_nodata = src_profile['nodata'], dst_nodata = src_profile['nodata'])
+    targ = warp(x, src_aff, (targ_h, targ_w), targ_aff, src_crs = src_srs, dst_crs = targ_srs, resampling = resampling, src_nodata = src_profile['nodata'])
     
     if outdir:
         outfile = "{0}/{1}_{2}.tif".format(outdir, os.path.splitext(os.path.basename(f))[0], suffix)
@@ -132,13 +140,9 @@ def cropToExtent(f, targ_e, res = 30, outdir = None, suffix = 'crop', check_if_e
             'width': targ_w,
             'height': targ_h,
             'crs': src_srs,
-            'blockxsize': targ_w,
-            'blockysize': 1,
-            'compress': 'lzw',
             'nodata': src_profile['nodata'],
             'count': src_profile['count'],
-            'dtype': src_profile['dtype'],
-            'driver': 'GTiff'
+            'dtype': src_profile['dtype']
         }
         
         write = True
@@ -147,27 +151,28 @@ def cropToExtent(f, targ_e, res = 30, outdir = None, suffix = 'crop', check_if_e
             if np.all(targ == src_profile['nodata']):
                 write = False
         if write:
-            with rasterio.open(outfile, 'w', **targ_profile) as dst:
-                dst.write(targ)
+            write_raster(outfile, targ, targ_profile)
             
     return targ
 
-def _cropToExtent(targ_e, res, outdir, suffix, check_if_empty, crs, f):
-    return cropToExtent(f, targ_e, res, outdir, suffix, check_if_empty, crs)
+def _cropToExtent(targ_e, res, outdir, suffix, check_if_empty, crs, resampling, f):
+    return cropToExtent(f, targ_e, res, outdir, suffix, check_if_empty, crs, resampling)
 
-def batchCropToExtent(fl, targ_e, outdir = None, suffix = 'crop', res = 30, njobs = 1, verbose = 0, check_if_empty = False, crs = None):
+def batchCropToExtent(fl, targ_e, outdir = None, suffix = 'crop', res = 30, njobs = 1, verbose = 0, check_if_empty = False, crs = None, resampling = 'nearest'):
     '''
     Crops a list of rasters
+
+    Files are processed in order, so that each job reuses the cached pixel map of files sharing a grid (see cropToExtent).
     '''
     
-    if not os.path.exists(outdir):
+    if outdir and not os.path.exists(outdir):
         raise ValueError("%s does not exist" % outdir)
     
+    fn = partial(_cropToExtent, targ_e, res, outdir, suffix, check_if_empty, crs, resampling)
     if njobs == 1:
-        Z = [cropToExtent(f, targ_e, res, check_if_empty = check_if_empty, crs = crs) for f in fl]
+        Z = [fn(f) for f in fl]
     else:
-        fn = partial(_cropToExtent, targ_e, res, outdir, suffix, check_if_empty, crs)
-        Z = Parallel(n_jobs = njobs, verbose = verbose)(delayed(fn)(f) for f in fl)
+        Z = Parallel(n_jobs = njobs, verbose = verbose, batch_size = max(1, len(fl) // (4 * njobs)))(delayed(fn)(f) for f in fl)
     
     if not outdir:
         return np.concatenate(Z, axis = 0)
@@ -228,22 +233,114 @@ def tileExtent(e, dx, dy, res = 30):
 
     return tiles
 
-def count_nobs(f):
+_valid_cache = OrderedDict()
+_VALID_CACHE_SIZE = 100000
+
+def valid_pixels(f, band = 1, overview_level = None, cache = True):
+    '''
+    Count valid (finite, non-nodata) pixels in a raster band, reading one block at a time
+
+    Arguments
+    ---------
+    f:              raster filename
+    band:           band number [1]
+    overview_level: (optional) read from this overview instead of full resolution (-1 = coarsest); ignored if the file has no overviews
+    cache:          use (and update) the per-file cache [True]
+
+    returns: (number of valid pixels, number of pixels) at the resolution that was read
+    '''
+    key = _valid_key(f, band, overview_level)
+    if cache and key in _valid_cache:
+        return _valid_cache[key]
+
+    kwargs = {}
+    if overview_level is not None:
+        with rasterio.open(f) as src:
+            n = len(src.overviews(band))
+        if n > 0:
+            kwargs['overview_level'] = n - 1 if overview_level < 0 else min(overview_level, n - 1)
+
+    nvalid = 0
+    ntotal = 0
+    with rasterio.open(f, **kwargs) as src:
+        nodata = src.nodata
+        for ji, win in src.block_windows(band):
+            x = src.read(band, window = win)
+            if np.issubdtype(x.dtype, np.floating):
+                valid = np.isfinite(x)
+                if nodata is not None:
+                    valid &= x != nodata
+            elif nodata is not None:
+                valid = x != nodata
+            else:
+                valid = np.ones(x.shape, dtype = bool)
+            nvalid += int(np.count_nonzero(valid))
+            ntotal += x.size
+
+    result = (nvalid, ntotal)
+    if cache:
+        _valid_cache[key] = result
+        if len(_valid_cache) > _VALID_CACHE_SIZE:
+            _valid_cache.popitem(last = False)
+
+    return result
+
+def valid_fraction(f, band = 1, overview_level = None, cache = True):
+    '''
+    Fraction of valid (finite, non-nodata) pixels in a raster band (see valid_pixels)
     '''
-    Count # non-NA observations in a raster
+    nvalid, ntotal = valid_pixels(f, band = band, overview_level = overview_level, cache = cache)
+    return nvalid / ntotal
+
+def batch_valid_pixels(fl, bands = [1], overview_level = None, njobs = 1, verbose = 0):
+    '''
+    Valid pixels (see valid_pixels) of each band of a list of rasters. Files are scanned in parallel, but results are cached in the calling process.
+
+    returns: list (one per file) of lists (one per band) of (number of valid pixels, number of pixels)
+    '''
+    todo = [(f, b) for f in fl for b in bands if not _valid_key(f, b, overview_level) in _valid_cache]
+    fn = partial(_valid_pixels, overview_level = overview_level)
+    if njobs > 1 and len(todo) > 1:
+        Z = Parallel(n_jobs = njobs, verbose = verbose)(delayed(fn)(f, b) for f, b in todo)
+    else:
+        Z = [fn(f, b) for f, b in todo]
+    for (f, b), z in zip(todo, Z):
+        _valid_cache[_valid_key(f, b, overview_level)] = z
+
+    return [[valid_pixels(f, band = b, overview_level = overview_level) for b in bands] for f in fl]
+
+def _valid_pixels(f, b, overview_level):
+    return valid_pixels(f, band = b, overview_level = overview_level, cache = False)
+
+def batch_valid_fraction(fl, band = 1, overview_level = None, njobs = 1, verbose = 0):
+    '''
+    Fraction of valid pixels for a list of rasters. Results are cached in the calling process (see batch_valid_pixels).
+    '''
+    batch_valid_pixels(fl, bands = [band], overview_level = overview_level, njobs = njobs, verbose = verbose)
+    return [valid_fraction(f, band = band, overview_level = overview_level) for f in fl]
+
+def _valid_key(f, band, overview_level):
+    st = os.stat(f)
+    return (os.path.abspath(f), st.st_mtime_ns, st.st_size, band, overview_level)
+
+def count_nobs(f, overview_level = None):
+    '''
+    Count # valid (non-NA) observations in a raster
     Arguments
     ---------
-    f:  raster filename
+    f:              raster filename
+    overview_level: (optional) estimate from this overview (-1 = coarsest); see valid_pixels
     '''
     with rasterio.open(f) as src:
-        nodata = src.profile['nodata']
-        count = src.profile['count']
-        nobs = []
-        for i in range(count):
-            x = src.read(i+1)
-            nobs.append((x == nodata).sum())
+        count = src.count
+        npix = src.width * src.height
+
+    nobs = []
+    for i in range(count):
+        nvalid, ntotal = valid_pixels(f, band = i + 1, overview_level = overview_level)
+        nobs.append(int(round(nvalid * npix / ntotal)))
 
     if count == 1:
         return nobs[0]
     else:
-        return nobs
\ No newline at end of file
+        return nobs
@@ -0,0 +1,163 @@
+'''
+Warping with cached source -> target index (and weight) maps
+'''
+import numpy as np
+from collections import OrderedDict
+from rasterio.crs import CRS
+from rasterio.warp import transform as transform_coords
+
+_map_cache = OrderedDict()
+# maximum total size (bytes) of the cached maps, per process (each joblib worker has its own cache)
+_MAP_CACHE_BYTES = 256 * 1024 ** 2
+
+RESAMPLING = ['nearest', 'bilinear']
+
+
+def _grid_key(shape, aff, crs):
+    return (tuple(shape), tuple(aff)[:6], CRS.from_user_input(crs).to_wkt() if crs else None)
+
+def _source_coords(src_transform, src_crs, dst_shape, dst_transform, dst_crs):
+    '''
+    Source (fractional) column and row of the center of each target pixel
+    '''
+    h, w = dst_shape
+    cols, rows = np.meshgrid(np.arange(w) + 0.5, np.arange(h) + 0.5)
+    xs, ys = dst_transform * (cols.ravel(), rows.ravel())
+    if src_crs and dst_crs and CRS.from_user_input(src_crs) != CRS.from_user_input(dst_crs):
+        xs, ys = transform_coords(dst_crs, src_crs, xs, ys)
+    c, r = ~src_transform * (np.asarray(xs), np.asarray(ys))
+    return np.asarray(c), np.asarray(r)
+
+def _index_dtype(src_shape):
+    return np.int32 if src_shape[0] * src_shape[1] < 2 ** 31 else np.int64
+
+def _nbytes(m):
+    return sum(a.nbytes for a in m if a is not None)
+
+def _gather_map(src_shape, src_transform, dst_shape, dst_transform, src_crs, dst_crs, resampling, cache):
+    '''
+    Returns (idx, outside, wgt): flat source indices clipped to the source grid (int32 unless the source has 2**31 pixels or more),
+    a boolean mask of the (neighbour, target pixel) pairs outside the source grid, and the weights (None for nearest). Cached if cache is True.
+    '''
+    if not resampling in RESAMPLING:
+        raise ValueError("resampling must be one of {0}".format(RESAMPLING))
+
+    key = (_grid_key(src_shape, src_transform, src_crs), _grid_key(dst_shape, dst_transform, dst_crs), resampling)
+    if cache and key in _map_cache:
+        _map_cache.move_to_end(key)
+        return _map_cache[key]
+
+    h, w = src_shape
+    dtype = _index_dtype(src_shape)
+    c, r = _source_coords(src_transform, src_crs, dst_shape, dst_transform, dst_crs)
+
+    if resampling == 'nearest':
+        c0 = np.floor(c).astype(np.int64)
+        r0 = np.floor(r).astype(np.int64)
+        offsets = [(0, 0, None)]
+    else:
+        # neighbours around the pixel center
+        c = c - 0.5
+        r = r - 0.5
+        c0 = np.floor(c).astype(np.int64)
+        r0 = np.floor(r).astype(np.int64)
+        fc = (c - c0).astype(np.float32)
+        fr = (r - r0).astype(np.float32)
+        offsets = [(0, 0, (1 - fr) * (1 - fc)), (0, 1, (1 - fr) * fc), (1, 0, fr * (1 - fc)), (1, 1, fr * fc)]
+
+    idx = np.empty((len(offsets), len(c)), dtype = dtype)
+    outside = np.empty((len(offsets), len(c)), dtype = bool)
+    wgt = None if resampling == 'nearest' else np.empty((len(offsets), len(c)), dtype = np.float32)
+    for k, (dr, dc, wt) in enumerate(offsets):
+        ci = c0 + dc
+        ri = r0 + dr
+        outside[k] = (ci < 0) | (ci >= w) | (ri < 0) | (ri >= h)
+        idx[k] = np.where(outside[k], 0, ri * w + ci)
+        if wgt is not None:
+            wgt[k] = np.where(outside[k], 0, wt)
+
+    m = (idx, outside, wgt)
+    if cache and _nbytes(m) <= _MAP_CACHE_BYTES:
+        _map_cache[key] = m
+        while sum(_nbytes(v) for v in _map_cache.values()) > _MAP_CACHE_BYTES:
+            _map_cache.popitem(last = False)
+
+    return m
+
+def warp_map(src_shape, src_transform, dst_shape, dst_transform, src_crs = None, dst_crs = None, resampling = 'nearest', cache = True):
+    '''
+    Source -> target index map (and resampling weights) between two grids
+
+    Arguments
+    ---------
+    src_shape:      source (rows, cols)
+    src_transform:  source affine transform
+    dst_shape:      target (rows, cols)
+    dst_transform:  target affine transform
+    src_crs:        (optional) source CRS
+    dst_crs:        (optional) target CRS (coordinates are transformed only if both are given and differ)
+    resampling:     'nearest' or 'bilinear' ['nearest']
+    cache:          use (and fill) the map cache [True]
+
+    Returns: (idx, wgt) where idx is an array of flat source indices of shape (k, target pixels) (-1 outside the source grid; int32 unless
+    the source has 2**31 pixels or more) and wgt a float32 array of weights of the same shape (None for nearest); k = 1 (nearest) or 4 (bilinear)
+
+    Details:
+    --------
+    Maps are cached per (source grid, target grid, resampling), least recently used first out, up to _MAP_CACHE_BYTES in total.
+    The cache is per process, so each (joblib) worker holds its own.
+    '''
+    idx, outside, wgt = _gather_map(src_shape, src_transform, dst_shape, dst_transform, src_crs, dst_crs, resampling, cache)
+    return np.where(outside, -1, idx), wgt
+
+def warp(x, src_transform, dst_shape, dst_transform, src_crs = None, dst_crs = None, resampling = 'nearest', src_nodata = None, dst_nodata = None, cache = True):
+    '''
+    Warps an array onto a target grid with a (cached) index map
+
+    Arguments
+    ---------
+    x:              source array of shape (rows, cols) or (bands, rows, cols)
+    src_transform:  source affine transform
+    dst_shape:      target (rows, cols)
+    dst_transform:  target affine transform
+    src_crs:        (optional) source CRS
+    dst_crs:        (optional) target CRS
+    resampling:     'nearest' or 'bilinear' ['nearest']
+    src_nodata:     (optional) source nodata value (excluded from bilinear interpolation)
+    dst_nodata:     (optional) value of target pixels without source data [src_nodata, or 0]
+    cache:          use the map cache [True]
+
+    Returns: warped array of shape dst_shape or (bands,) + dst_shape, with the dtype of x
+
+    Details:
+    --------
+    Bilinear resampling interpolates the 4 source pixels around each target pixel center, with the weights of nodata (or outside) neighbours
+    redistributed to the valid ones. Away from source edges and nodata, this matches rasterio.warp.reproject when source and target resolutions
+    are equal (or the target is finer), up to rounding of integer outputs (+/- 1). It does not when the target is coarser: GDAL then widens
+    the kernel to the target pixel footprint, while warp still uses 4 neighbours, so noisy data can differ substantially.
+    Use rasterio.warp.reproject (or average the source first) to downsample.
+    '''
+    if dst_nodata is None:
+        dst_nodata = 0 if src_nodata is None else src_nodata
+
+    idx, outside, wgt = _gather_map(x.shape[-2:], src_transform, dst_shape, dst_transform, src_crs, dst_crs, resampling, cache)
+    src = x.reshape((-1, x.shape[-2] * x.shape[-1]))
+    g = src[:, idx]
+
+    if wgt is None:
+        out = g[:, 0]
+        out[:, outside[0]] = dst_nodata
+    else:
+        valid = ~outside[np.newaxis] & (g == g)
+        if src_nodata is not None:
+            valid &= g != src_nodata
+        wt = np.where(valid, wgt[np.newaxis], 0)
+        total = wt.sum(axis = 1)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            out = (np.where(valid, g, 0) * wt).sum(axis = 1) / total
+        if np.issubdtype(x.dtype, np.integer):
+            out = np.round(out)
+        out[total <= 0] = dst_nodata
+        out = out.astype(x.dtype)
+
+    return out.reshape(x.shape[:-2] + tuple(dst_shape))
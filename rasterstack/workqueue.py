@@ -0,0 +1,191 @@
+'''
+SQLite work queue of (tile, product) tasks, shared by several (local or networked) worker processes
+'''
+import os
+import socket
+import sqlite3
+import time
+import traceback
+
+from .chunking import cpu_count, parse_bytes
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tile TEXT NOT NULL,
+    product TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    started REAL,
+    finished REAL,
+    error TEXT,
+    UNIQUE (tile, product)
+)
+'''
+
+
+class WorkQueue(object):
+    '''
+    Arguments
+    ---------
+    path:       SQLite database file (created if it does not exist)
+    timeout:    seconds to wait for a lock held by another worker [60]
+
+    Details:
+    --------
+    Tasks move from 'pending' to 'running' (claimed by one worker) to 'done' or 'failed'. Claims are made in an immediate
+    (write-locked) transaction, so each task is run by one worker only. Workers on other machines can share the queue if the
+    database is on a file system with working file locks (e.g., not all NFS setups).
+    '''
+    def __init__(self, path, timeout = 60):
+        self.path = path
+        self.timeout = timeout
+        with self._connect() as con:
+            con.execute(_SCHEMA)
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout = self.timeout, isolation_level = None)
+        return _Transaction(con)
+
+    def add(self, tasks):
+        '''
+        Adds a list of (tile, product) tasks. Tasks already in the queue are ignored.
+
+        Returns: number of tasks added
+        '''
+        with self._connect() as con:
+            n = con.total_changes
+            con.executemany("INSERT OR IGNORE INTO tasks (tile, product) VALUES (?, ?)", [(str(t), str(p)) for t, p in tasks])
+            return con.total_changes - n
+
+    def claim(self, worker = None):
+        '''
+        Claims the next pending task
+
+        Returns: (id, tile, product), or None if no task is pending
+        '''
+        if worker is None:
+            worker = "{0}:{1}".format(socket.gethostname(), os.getpid())
+        with self._connect() as con:
+            row = con.execute("SELECT id, tile, product FROM tasks WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            con.execute("UPDATE tasks SET status = 'running', worker = ?, started = ?, error = NULL WHERE id = ?", (worker, time.time(), row[0]))
+            return row
+
+    def done(self, id):
+        with self._connect() as con:
+            con.execute("UPDATE tasks SET status = 'done', finished = ? WHERE id = ?", (time.time(), id))
+
+    def failed(self, id, error = None):
+        with self._connect() as con:
+            con.execute("UPDATE tasks SET status = 'failed', finished = ?, error = ? WHERE id = ?", (time.time(), error, id))
+
+    def reset(self, failed = False, stale = None):
+        '''
+        Returns tasks to the queue
+
+        Arguments
+        ---------
+        failed:     reset failed tasks [False]
+        stale:      (optional) reset tasks that have been running for more than this number of seconds (e.g., crashed workers)
+
+        Returns: number of tasks reset
+        '''
+        with self._connect() as con:
+            n = con.total_changes
+            if failed:
+                con.execute("UPDATE tasks SET status = 'pending' WHERE status = 'failed'")
+            if stale is not None:
+                con.execute("UPDATE tasks SET status = 'pending' WHERE status = 'running' AND started < ?", (time.time() - stale,))
+            return con.total_changes - n
+
+    def status(self):
+        '''
+        Returns a dictionary of the number of tasks in each state
+        '''
+        with self._connect() as con:
+            return dict(con.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+    def tasks(self, status = None):
+        '''
+        Returns a list of (id, tile, product, status, worker, error) tuples
+        '''
+        with self._connect() as con:
+            q = "SELECT id, tile, product, status, worker, error FROM tasks"
+            if status is None:
+                return con.execute(q + " ORDER BY id").fetchall()
+            return con.execute(q + " WHERE status = ? ORDER BY id", (status,)).fetchall()
+
+
+class _Transaction(object):
+    '''
+    Connection context: a write-locked (immediate) transaction, committed on success and rolled back on error
+    '''
+    def __init__(self, con):
+        self.con = con
+
+    def __enter__(self):
+        self.con.execute("BEGIN IMMEDIATE")
+        return self.con
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.con.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        finally:
+            self.con.close()
+
+
+def worker_limits(nworkers, mem_budget = None):
+    '''
+    Splits the cores (and memory budget) of a machine between nworkers worker processes
+
+    Returns: (cores, mem_budget) per worker
+    '''
+    cores = max(1, cpu_count() // max(1, nworkers))
+    if mem_budget is not None:
+        mem_budget = parse_bytes(mem_budget) // max(1, nworkers)
+    return cores, mem_budget
+
+def work(queue, fn, worker = None, cores = None, verbose = True):
+    '''
+    Runs tasks from a WorkQueue until none is pending
+
+    Arguments
+    ---------
+    queue:      WorkQueue (or path to the SQLite database)
+    fn:         function called as fn(tile, product) for each task
+    worker:     (optional) worker name [hostname:pid]
+    cores:      (optional) number of cores this worker may use; chunk-level workers, OpenMP threads and GDAL compression threads
+                chosen by rasterstack (njobs from mem_budget, theilsen/composite nthreads, write_raster num_threads) are limited to this number (see details)
+    verbose:    print task outcomes [True]
+
+    Returns: number of tasks run
+
+    Details:
+    --------
+    cores is passed on through the RASTERSTACK_NUM_CPUS environment variable (read by chunking.cpu_count), so that tile-level
+    and chunk-level parallelism do not oversubscribe the machine. It should be set before any worker pool is started.
+    Explicit njobs, nthreads or num_threads arguments are not limited.
+    '''
+    if not isinstance(queue, WorkQueue):
+        queue = WorkQueue(queue)
+    if cores is not None:
+        os.environ['RASTERSTACK_NUM_CPUS'] = str(cores)
+
+    n = 0
+    while True:
+        task = queue.claim(worker = worker)
+        if task is None:
+            return n
+        id, tile, product = task
+        try:
+            fn(tile, product)
+            queue.done(id)
+            if verbose:
+                print("{0} {1}: done".format(tile, product))
+        except Exception:
+            queue.failed(id, traceback.format_exc())
+            if verbose:
+                print("{0} {1}: failed".format(tile, product))
+        n += 1
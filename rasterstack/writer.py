@@ -0,0 +1,131 @@
+'''
+Shared raster writer
+'''
+import os
+import tempfile
+import rasterio
+import numpy as np
+from rasterio.shutil import copy as copy_raster
+from rasterio.windows import Window
+
+from .chunking import cpu_count
+
+# profile keys that are not creation options
+_DATASET_KEYS = ['driver', 'count', 'dtype', 'width', 'height', 'crs', 'transform', 'nodata']
+
+
+def output_profile(profile, cog = True, compress = 'zstd', predictor = None, level = None, blocksize = 512, num_threads = None, overviews = True, resampling = 'nearest'):
+    '''
+    Returns a copy of a rasterio profile with creation options for tiled, compressed output
+
+    Arguments
+    ---------
+    profile:        rasterio profile (count, dtype, width, height, crs, transform, nodata)
+    cog:            write a Cloud-Optimized GeoTIFF [True]
+    compress:       one of 'zstd', 'deflate', 'lzw' or None ['zstd']
+    predictor:      TIFF predictor (1 = none, 2 = horizontal, 3 = floating point). If None, 2 is used for integers and 3 for floats [None]
+    level:          (optional) compression level for 'zstd' or 'deflate'
+    blocksize:      internal tile size (multiple of 16) [512]
+    num_threads:    number of threads used by GDAL to compress tiles [chunking.cpu_count(), i.e. RASTERSTACK_NUM_CPUS if set]
+    overviews:      (COG only) build internal overviews [True]
+    resampling:     (COG only) overview resampling method ['nearest']
+    '''
+    if blocksize % 16 != 0:
+        raise ValueError("blocksize must be a multiple of 16")
+    if compress is not None and not compress.lower() in ['zstd', 'deflate', 'lzw']:
+        raise ValueError("compress must be one of ['zstd', 'deflate', 'lzw'] or None")
+
+    out = {k: profile[k] for k in ['count', 'dtype', 'width', 'height', 'crs', 'transform', 'nodata'] if k in profile}
+    out['num_threads'] = str(cpu_count() if num_threads is None else num_threads)
+
+    if compress is None:
+        out['compress'] = 'none'
+    else:
+        out['compress'] = compress.lower()
+        if predictor is None:
+            predictor = 3 if np.issubdtype(np.dtype(out['dtype']), np.floating) else 2
+        out['predictor'] = predictor
+        if level is not None:
+            if cog:
+                out['level'] = level
+            elif compress.lower() == 'zstd':
+                out['zstd_level'] = level
+            elif compress.lower() == 'deflate':
+                out['zlevel'] = level
+
+    if cog:
+        out.update(
+            driver = 'COG',
+            blocksize = blocksize,
+            overviews = 'auto' if overviews else 'none',
+            resampling = resampling,
+            bigtiff = 'if_safer'
+        )
+    else:
+        out.update(
+            driver = 'GTiff',
+            tiled = True,
+            blockxsize = blocksize,
+            blockysize = blocksize,
+            bigtiff = 'if_safer'
+        )
+
+    return out
+
+
+def write_raster(outfile, arr, profile, **kwargs):
+    '''
+    Writes a 2-D or 3-D (band, row, col) array to a tiled, compressed raster
+
+    Arguments
+    ---------
+    outfile:    output filename
+    arr:        2-D or 3-D array
+    profile:    rasterio profile of the output. 'count' and 'dtype' are taken from arr.
+
+    Keyword arguments (kwargs)
+    --------------------------
+    See output_profile
+
+    Details:
+    --------
+    Windows of complete tile rows are written in sequence to a tiled GeoTIFF; GDAL compresses the tiles of each window on 'num_threads' threads.
+    COG output is first written (uncompressed) to a temporary tiled GeoTIFF next to outfile, which the COG driver then copies to outfile,
+    compressing tiles on 'num_threads' threads and building overviews. Neither step holds a second copy of arr in memory.
+    '''
+    if arr.ndim == 2:
+        arr = arr.reshape((1, arr.shape[0], arr.shape[1]))
+    elif arr.ndim != 3:
+        raise ValueError("arr must be a 2-D or 3-D array")
+
+    profile = dict(profile)
+    profile.update(count = arr.shape[0], height = arr.shape[1], width = arr.shape[2], dtype = arr.dtype.name)
+    profile = output_profile(profile, **kwargs)
+
+    if profile['driver'] != 'COG':
+        _write_windows(outfile, arr, profile, profile['blockysize'])
+        return outfile
+
+    blocksize = profile['blocksize']
+    tmp_profile = {k: profile[k] for k in _DATASET_KEYS if k in profile}
+    tmp_profile.update(driver = 'GTiff', tiled = True, blockxsize = blocksize, blockysize = blocksize, compress = 'none', bigtiff = 'if_safer')
+    options = {k: v for k, v in profile.items() if not k in _DATASET_KEYS}
+
+    fd, tmpfile = tempfile.mkstemp(suffix = '.tif', dir = os.path.dirname(os.path.abspath(outfile)))
+    os.close(fd)
+    try:
+        _write_windows(tmpfile, arr, tmp_profile, blocksize)
+        copy_raster(tmpfile, outfile, driver = 'COG', **options)
+    finally:
+        os.remove(tmpfile)
+
+    return outfile
+
+def _write_windows(outfile, arr, profile, blocksize):
+    '''
+    Writes arr in windows of complete tile rows
+    '''
+    with rasterio.open(outfile, 'w', **profile) as dst:
+        for r in range(0, arr.shape[1], blocksize):
+            nrows = min(blocksize, arr.shape[1] - r)
+            dst.write(arr[:, r:r + nrows, :], window = Window(0, r, arr.shape[2], nrows))
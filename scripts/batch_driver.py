@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+from rasterstack.workqueue import WorkQueue, work, worker_limits
+from multiprocessing import Process
+import os, sys, glob, argparse, warnings
+
+import batch_compute_stats
+import batch_quarter_composites
+
+# total memory of each machine, shared by its workers
+MEM_BUDGET = '16G'
+
+PRODUCTS = ['stats', 'quarters']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description = "Schedule (tile, product) tasks through a shared SQLite work queue")
+    sub = parser.add_subparsers(dest = 'command', required = True)
+
+    p = sub.add_parser('init', help = "add the SWF* tiles in indir to the queue")
+    p.add_argument('queue', help = "SQLite work queue file")
+    p.add_argument('indir')
+    p.add_argument('--products', default = ','.join(PRODUCTS), help = "comma-separated products [{0}]".format(','.join(PRODUCTS)))
+
+    p = sub.add_parser('work', help = "run worker processes on this machine until the queue is empty")
+    p.add_argument('queue')
+    p.add_argument('outdir', help = "output directory for quarterly composites")
+    p.add_argument('--workers', type = int, default = 4, help = "number of worker processes on this machine [4]")
+    p.add_argument('--mem', default = MEM_BUDGET, help = "memory budget of this machine, split between workers [{0}]".format(MEM_BUDGET))
+    p.add_argument('--precollection', action = 'store_true')
+
+    p = sub.add_parser('status', help = "print the number of tasks in each state (and failed tasks)")
+    p.add_argument('queue')
+
+    p = sub.add_parser('reset', help = "return failed and/or stale tasks to the queue")
+    p.add_argument('queue')
+    p.add_argument('--failed', action = 'store_true')
+    p.add_argument('--stale', type = float, default = None, help = "reset tasks running for more than this number of hours")
+
+    return parser.parse_args()
+
+def run_task(outdir, precollection, mem_budget, tile, product):
+    if product == 'stats':
+        batch_compute_stats.process_tile(tile, precollection, mem_budget = mem_budget)
+    elif product == 'quarters':
+        batch_quarter_composites.process_tile(tile, outdir, precollection, mem_budget = mem_budget)
+    else:
+        raise ValueError("Unknown product '{0}'".format(product))
+
+def worker(queue, outdir, precollection, mem_budget, cores):
+    with warnings.catch_warnings():
+        # pixels without valid observations; other warnings (e.g., a missing compiled kernel) are still shown
+        warnings.filterwarnings('ignore', message = 'Mean of empty slice|All-NaN slice encountered|Degrees of freedom <= 0', category = RuntimeWarning)
+        work(queue, lambda tile, product: run_task(outdir, precollection, mem_budget, tile, product), cores = cores)
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    if args.command == 'init':
+        dirs = sorted(glob.glob("{0}/SWF*".format(args.indir)))
+        products = args.products.split(',')
+        n = WorkQueue(args.queue).add([(os.path.abspath(d), p) for d in dirs for p in products])
+        print("{0} tasks added".format(n))
+
+    elif args.command == 'work':
+        os.makedirs(args.outdir, exist_ok = True)
+        # each worker gets an equal share of cores and memory for its own (chunk-level) jobs and OpenMP threads
+        cores, mem_budget = worker_limits(args.workers, args.mem)
+        procs = [Process(target = worker, args = (args.queue, args.outdir, args.precollection, mem_budget, cores)) for i in range(args.workers)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+
+    elif args.command == 'status':
+        q = WorkQueue(args.queue)
+        print(q.status())
+        for id, tile, product, status, w, error in q.tasks('failed'):
+            print("{0} {1} ({2}):\n{3}".format(tile, product, w, error))
+
+    elif args.command == 'reset':
+        stale = None if args.stale is None else args.stale * 3600
+        print("{0} tasks reset".format(WorkQueue(args.queue).reset(failed = args.failed, stale = stale)))
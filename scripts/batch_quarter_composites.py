@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 
-from rasterstack import RasterTimeSeries
+from rasterstack import RasterTimeSeries, write_raster
 import rasterio
 import numpy as np
 import os, sys, glob, warnings
 import pandas as pd
 from datetime import datetime
 
+# total memory for compute_stats; chunk size and number of jobs are chosen to fit
+MEM_BUDGET = '16G'
+
 
 def get_files(indir, string):
     fl = []
@@ -23,51 +26,53 @@ def get_landsat_dates(fl, precollection=False):
         dates = [datetime.strptime(os.path.basename(f).split('_')[3], "%Y%m%d") for f in fl]
     return dates
 
+def process_tile(d, outdir, precollection = False, mem_budget = MEM_BUDGET):
+    '''
+    Quarterly composites for one tile directory
+    '''
+    tile = os.path.basename(d).split('_')[1]
+    fl = get_files(d, "pass01")
+
+    if len(fl) > 10:
+        print(d)
+        dates = get_landsat_dates(fl, precollection=precollection)
+        r = RasterTimeSeries(fl, dates)
+        profile = r.profile.copy()
+        nobs_profile = r.profile.copy()
+
+        profile.update(count = 3, nodata = 255)
+        nobs_profile.update(count = 1, dtype = np.int16, nodata = -9999)
+
+        tiledir = "{0}/{1}".format(outdir, tile)
+        if not os.path.exists(tiledir):
+            os.makedirs(tiledir)   
+        
+        # quarter composites
+        years = list(range(1984, 2018))
+        quarters = [[1, 2, 3], [4, 5, 6], [7, 8, 9], [10, 11, 12]]
+            
+        for y in years:
+            for i, q in enumerate(quarters):
+                try:
+                    zco, zmn, zmd, zst = r.compute_stats(mem_budget = mem_budget, months = q, years = y)
+                    if zco.sum() == 0:
+                        continue
+                    zstats = np.stack([zmn, zmd, zst])                     
+                    outfl = ["{0}/{1}_{2}Q{3}.tif".format(tiledir, j, y, i+1) for j in ['stats', 'nobs']]
+                    write_raster(outfl[0], zstats.astype(np.uint8), profile)
+                    write_raster(outfl[1], zco.astype(np.int16), nobs_profile)
+                    print("{0}Q{1} ".format(y, i+1), end = "")
+                except:
+                    pass
+
 def main(indir, outdir, precollection):
     dirs = sorted(glob.glob("{0}/SWF*".format(indir)))
-    tiles = [os.path.basename(d).split('_')[1] for d in dirs]
     
     if not os.path.exists(outdir):
         os.makedirs(outdir)
     
-    for ind, d in enumerate(dirs):
-        
-        tile = tiles[ind]
-        fl = get_files(d, "pass01")
-
-        if len(fl) > 10:
-            print(d)
-            dates = get_landsat_dates(fl, precollection=precollection)
-            r = RasterTimeSeries(fl, dates)
-            profile = r.profile.copy()
-            nobs_profile = r.profile.copy()
-
-            profile.update(count = 3, nodata = 255, compress = 'lzw')
-            nobs_profile.update(count = 1, dtype = np.int16, nodata = -9999, compress = 'lzw')
-
-            tiledir = "{0}/{1}".format(outdir, tile)
-            if not os.path.exists(tiledir):
-                os.makedirs(tiledir)   
-            
-            # quarter composites
-            years = list(range(1984, 2018))
-            quarters = [[1, 2, 3], [4, 5, 6], [7, 8, 9], [10, 11, 12]]
-                
-            for y in years:
-                for i, q in enumerate(quarters):
-                    try:
-                        zco, zmn, zmd, zst = r.compute_stats(njobs = 15, months = q, years = y)
-                        if zco.sum() == 0:
-                            continue
-                        zstats = np.stack([zmn, zmd, zst])                     
-                        outfl = ["{0}/{1}_{2}Q{3}.tif".format(tiledir, j, y, i+1) for j in ['stats', 'nobs']]
-                        with rasterio.open(outfl[0], 'w', **profile) as dst:
-                            dst.write(zstats.astype(np.uint8))
-                        with rasterio.open(outfl[1], 'w', **nobs_profile) as dst:
-                            dst.write(zco.astype(np.int16).reshape((1, zco.shape[0], zco.shape[1])))
-                        print("{0}Q{1} ".format(y, i+1), end = "")
-                    except:
-                        pass
+    for d in dirs:
+        process_tile(d, outdir, precollection)
 
 if __name__ == '__main__':
 
@@ -1,8 +1,16 @@
 from setuptools import setup, Extension
 import os
-from Cython.Build import cythonize
-import numpy as np
 import platform
+import warnings
+
+# compiled extensions are optional: without Cython (or a compiler), pure NumPy fallbacks are used.
+# pyproject.toml requires Cython in the (isolated) build environment, so this only applies to builds without build isolation
+try:
+    from Cython.Build import cythonize
+    import numpy as np
+except ImportError:
+    cythonize = None
+    warnings.warn("Cython (or NumPy) is not available: rasterstack._theilsen and rasterstack._composite are not built, and (slower) NumPy versions will be used")
 
 # use a compiler with openmp support
 # I had problems on mac with clang
@@ -12,10 +20,18 @@ if "macOS" in platform.platform():
 
 ext_modules = [
     Extension(
-        "rasterstack.theilsen",
-        ["rasterstack/theilsen.pyx"],
+        "rasterstack._theilsen",
+        ["rasterstack/_theilsen.pyx"],
+        extra_compile_args=['-fopenmp'],
+        extra_link_args=['-fopenmp'],
+        optional=True
+        ),
+    Extension(
+        "rasterstack._composite",
+        ["rasterstack/_composite.pyx"],
         extra_compile_args=['-fopenmp'],
-        extra_link_args=['-fopenmp']
+        extra_link_args=['-fopenmp'],
+        optional=True
         )
 ]
 
@@ -29,17 +45,19 @@ setup(
     version = __version__,
     packages = ['rasterstack',],
     license = 'MIT',
-    ext_modules = cythonize(ext_modules, language_level = 3),
-    include_dirs = [np.get_include()],
+    ext_modules = cythonize(ext_modules, language_level = 3) if cythonize else [],
+    include_dirs = [np.get_include()] if cythonize else [],
     long_description = read('README.md'),
     install_requires = [
         'rasterio', 
         'numpy', 
         'datetime', 
         'pandas',
-        'joblib',
-        'cython'
+        'joblib'
         ],
+    extras_require = {
+        'cube': ['zarr']
+        },
     author = 'Ben DeVries',
     author_email = 'bdv@uoguelph.ca',
     url = 'http://github.com/bendv/rasterstack'
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import rasterio
+from affine import Affine
+from datetime import datetime, timedelta
+
+
+@pytest.fixture
+def make_stack(tmp_path):
+    '''
+    Writes n single-scene rasters (uint8 band 1 with nodata pixels, QA band 2 with value 1 = cloud) and returns (filenames, dates)
+    '''
+    def make(n = 12, step = 16, h = 40, w = 30, nodata = 0, cloud = 0.2, seed = 0, start = datetime(2017, 1, 1)):
+        rng = np.random.default_rng(seed)
+        fl = []
+        dates = []
+        for i in range(n):
+            x = np.zeros((2, h, w), dtype = np.uint8)
+            x[0] = rng.integers(1, 250, size = (h, w))
+            if nodata is not None:
+                x[0, rng.random((h, w)) < 0.1] = nodata
+            x[1] = rng.random((h, w)) < cloud
+            f = str(tmp_path / 'scene_{0:02d}.tif'.format(i))
+            profile = dict(driver = 'GTiff', width = w, height = h, count = 2, dtype = 'uint8', nodata = nodata,
+                           crs = 'EPSG:32617', transform = Affine(30, 0, 500000, 0, -30, 5000000))
+            with rasterio.open(f, 'w', **profile) as dst:
+                dst.write(x)
+            fl.append(f)
+            dates.append(start + timedelta(days = step * i))
+        return fl, dates
+    return make
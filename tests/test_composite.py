@@ -0,0 +1,24 @@
+import warnings
+import numpy as np
+import rasterio
+
+from rasterstack import RasterTimeSeries
+
+
+def test_composite_flags_empty_pixels_without_nodata(make_stack, tmp_path):
+    fl, dates = make_stack(n = 3, nodata = None, cloud = 0.6)
+    rts = RasterTimeSeries(fl, dates)
+    outfile = str(tmp_path / 'composite.tif')
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        comp, date = rts.composite([1], maskband = 2, outfile = outfile)
+
+    # band 1 values are 1-249, so the largest free uint8 value flags pixels that are cloudy in every scene
+    empty = np.isnan(date)
+    assert empty.any()
+    assert (comp[:, empty] == 255).all()
+    assert (comp[:, ~empty] < 250).all()
+    with rasterio.open(outfile) as src:
+        assert src.nodata == 255
+        np.testing.assert_array_equal(src.read(), comp)
@@ -0,0 +1,64 @@
+import tracemalloc
+import numpy as np
+
+from rasterstack import RasterTimeSeries, fill_gaps
+
+
+def _series(n = 15, npix = 200, gaps = 0.4, seed = 0):
+    rng = np.random.default_rng(seed)
+    t = np.sort(rng.choice(np.arange(0, 400), n, replace = False)).astype(np.float64)
+    x = rng.random((n, npix)).astype(np.float32)
+    x[rng.random(x.shape) < gaps] = np.nan
+    return x, t
+
+def test_linear_matches_interp():
+    x, t = _series()
+    tout = np.linspace(t[0], t[-1], 40)
+    y = fill_gaps(x, t, tout)
+
+    for j in range(x.shape[1]):
+        ok = np.isfinite(x[:,j])
+        ref = np.interp(tout, t[ok], x[ok,j], left = np.nan, right = np.nan)
+        np.testing.assert_allclose(y[:,j], ref, rtol = 1e-5, equal_nan = True)
+
+def test_valid_observations_unchanged():
+    x, t = _series()
+    y = fill_gaps(x, t)
+    ok = np.isfinite(x)
+    np.testing.assert_array_equal(y[ok], x[ok])
+
+def test_nearest():
+    x = np.array([1, np.nan, np.nan, 4], dtype = np.float32)[:, np.newaxis]
+    t = [0, 10, 20, 30]
+    y = fill_gaps(x, t, [0, 5, 14, 16, 30], method = 'nearest')
+    np.testing.assert_array_equal(y[:,0], [1, 1, 1, 4, 4])
+
+def test_max_gap():
+    x = np.array([[1, 1], [np.nan, 2], [3, np.nan], [np.nan, np.nan], [np.nan, np.nan], [6, 6]], dtype = np.float32)
+    t = [0, 10, 20, 30, 40, 50]
+    y = fill_gaps(x, t, [5, 15, 35], max_gap = 20)
+
+    # first pixel: 0-20 is filled, 20-50 is too long; second pixel: 0-10 is filled, 10-50 is too long
+    np.testing.assert_allclose(y[:,0], [1.5, 2.5, np.nan])
+    np.testing.assert_allclose(y[:,1], [1.5, np.nan, np.nan])
+
+def test_no_extrapolation():
+    x = np.array([np.nan, 2, 3, np.nan], dtype = np.float32)[:, np.newaxis]
+    t = [0, 10, 20, 30]
+    for method in ['linear', 'nearest']:
+        y = fill_gaps(x, t, [-5, 0, 5, 15, 25, 30, 35], method = method)
+        assert np.isnan(y[[0, 1, 2, 4, 5, 6], 0]).all()
+        assert y[3, 0] == (2.5 if method == 'linear' else 2)
+
+def test_stats_within_memory_budget(make_stack):
+    fl, dates = make_stack(n = 40, step = 8, h = 200, w = 200)
+    gts = RasterTimeSeries(fl, dates).gapfill(step = 4, maskband = 2)
+    budget = 4 * 1024 ** 2
+
+    for kwargs in [dict(stats = ['nobs', 'mean', 'std']), dict()]:
+        fn = gts.compute_stats if kwargs else gts.trend
+        tracemalloc.start()
+        fn(mem_budget = budget, njobs = 1, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert peak < budget
@@ -0,0 +1,26 @@
+import numpy as np
+
+from rasterstack import RasterTimeSeries
+
+
+def test_nonoverlapping_windows_add_up_to_stack_nobs(make_stack):
+    # the last date is a window boundary (19 * 17 days after the first date)
+    fl, dates = make_stack(n = 20, step = 17)
+    rts = RasterTimeSeries(fl, dates)
+
+    starts, out = rts.rolling(window = 17, stats = ['nobs'], maskband = 2, rchunk = 16)
+    nobs = rts.compute_stats(stats = ['nobs'], maskband = 2)[0]
+
+    assert starts[-1] == dates[-1]
+    np.testing.assert_array_equal(np.sum([o[0] for o in out], axis = 0), nobs)
+
+def test_windows_match_compute_stats(make_stack):
+    fl, dates = make_stack(n = 12, step = 16)
+    rts = RasterTimeSeries(fl, dates)
+
+    starts, out = rts.rolling(window = 64, step = 64, maskband = 2)
+    assert len(starts) == 3
+    for k, o in enumerate(out):
+        ref = RasterTimeSeries(fl[4 * k:4 * k + 4], dates[4 * k:4 * k + 4]).compute_stats(maskband = 2)
+        for a, b in zip(o, ref):
+            np.testing.assert_array_equal(a, b)
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from rasterstack.theilsen import _theilsen_c, _theilsen_numpy
+
+requires_kernel = pytest.mark.skipif(_theilsen_c is None, reason = "rasterstack._theilsen was not built")
+
+
+def _ties(n, seed = 0):
+    # few distinct values, so most pixels have several groups of tied values
+    rng = np.random.default_rng(seed)
+    arr = rng.integers(0, 4, size = (n, 12, 9)).astype(np.float64)
+    x = np.sort(rng.uniform(2000, 2020, size = n))
+    return arr, x
+
+def test_numpy_known_values():
+    # slopes 0, .5, .5, 2/3, 1, 1; S = 5; one pair of ties: Var(S) = (4 * 3 * 13 - 2 * 1 * 9) / 18
+    arr = np.array([1., 2., 2., 3.]).reshape((4, 1, 1))
+    ts, S, Z = _theilsen_numpy(arr)
+    assert ts[0, 0] == pytest.approx((0.5 + 2 / 3.) / 2)
+    assert S[0, 0] == 5
+    assert Z[0, 0] == pytest.approx(4 / np.sqrt((156 - 18) / 18.))
+
+@requires_kernel
+@pytest.mark.parametrize('n', [7, 8, 15, 16])
+def test_kernel_matches_numpy_with_ties(n):
+    arr, x = _ties(n, seed = n)
+    for xi in [None, x]:
+        ts, S, Z = _theilsen_c(arr, xi, nthreads = 2)
+        ts0, S0, Z0 = _theilsen_numpy(arr, xi)
+        np.testing.assert_allclose(ts, ts0)
+        np.testing.assert_array_equal(S, S0)
+        np.testing.assert_allclose(Z, Z0)
+
+@requires_kernel
+def test_kernel_known_values():
+    arr = np.array([1., 2., 2., 3.]).reshape((4, 1, 1))
+    ts, S, Z = _theilsen_c(arr, None, nthreads = 1)
+    assert ts[0, 0] == pytest.approx((0.5 + 2 / 3.) / 2)
+    assert S[0, 0] == 5
+    assert Z[0, 0] == pytest.approx(4 / np.sqrt((156 - 18) / 18.))
+
+def _brute(y, x):
+    # Theil-Sen slope, S and Z of one series, over its valid observations
+    v = np.isfinite(y)
+    y = y[v]
+    x = x[v]
+    n = len(y)
+    i, j = np.triu_indices(n, 1)
+    S = np.sign(y[j] - y[i]).sum()
+    t = np.unique(y, return_counts = True)[1]
+    varS = (n * (n - 1) * (2 * n + 5) - (t * (t - 1) * (2 * t + 5)).sum()) / 18.
+    Z = (S - np.sign(S)) / np.sqrt(varS) if S != 0 else 0.
+    return np.median((y[j] - y[i]) / (x[j] - x[i])), S, Z
+
+def _gaps(n, seed = 0):
+    arr, x = _ties(n, seed = seed)
+    rng = np.random.default_rng(seed + 1)
+    arr[rng.random(arr.shape) < 0.3] = np.nan
+    # fewer than 2 valid observations
+    arr[:, 0, 0] = np.nan
+    arr[1:, 0, 1] = np.nan
+    return arr, x
+
+@pytest.mark.parametrize('n', [8, 15])
+def test_numpy_skips_missing(n):
+    arr, x = _gaps(n, seed = n)
+    ts, S, Z = _theilsen_numpy(arr, x)
+    assert np.isnan(ts[0, :2]).all() and np.isnan(Z[0, :2]).all() and (S[0, :2] == 0).all()
+    for r, c in [(3, 4), (7, 2), (11, 8)]:
+        ts0, S0, Z0 = _brute(arr[:, r, c], x)
+        assert ts[r, c] == pytest.approx(ts0)
+        assert S[r, c] == S0
+        assert Z[r, c] == pytest.approx(Z0)
+
+@requires_kernel
+@pytest.mark.parametrize('n', [8, 15])
+def test_kernel_matches_numpy_with_missing(n):
+    arr, x = _gaps(n, seed = n)
+    ts, S, Z = _theilsen_c(arr, x, nthreads = 2)
+    ts0, S0, Z0 = _theilsen_numpy(arr, x)
+    np.testing.assert_allclose(ts, ts0)
+    np.testing.assert_array_equal(S, S0)
+    np.testing.assert_allclose(Z, Z0)
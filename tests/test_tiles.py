@@ -0,0 +1,32 @@
+import numpy as np
+import rasterio
+
+from rasterstack import RasterTimeSeries
+from rasterstack import tiles
+
+
+def test_parallel_count_obs_fills_cache(make_stack):
+    fl, dates = make_stack(n = 4)
+    tiles._valid_cache.clear()
+
+    rts = RasterTimeSeries(fl, dates)
+    rts.count_obs(njobs = 2)
+
+    for f, nobs in zip(fl, rts.data['nobs']):
+        with rasterio.open(f) as src:
+            x = src.read()
+        # nodata (0) applies to every band
+        assert nobs == [int(np.count_nonzero(b != 0)) for b in x]
+        for b in [1, 2]:
+            assert tiles._valid_key(f, b, None) in tiles._valid_cache
+
+def test_batch_valid_fraction_uses_cache(make_stack):
+    fl, dates = make_stack(n = 3)
+    tiles._valid_cache.clear()
+
+    v = tiles.batch_valid_fraction(fl, njobs = 2)
+    assert len(tiles._valid_cache) == 3
+    # cached results are used as long as the file is unchanged
+    key = tiles._valid_key(fl[0], 1, None)
+    tiles._valid_cache[key] = (0, 1)
+    assert tiles.batch_valid_fraction(fl) == [0.] + v[1:]
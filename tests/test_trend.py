@@ -0,0 +1,36 @@
+import numpy as np
+import rasterio
+
+from rasterstack import RasterTimeSeries
+from rasterstack.rasterstack import _decimal_years
+from rasterstack.theilsen import _theilsen_numpy
+
+
+def _masked(fl):
+    x = np.stack([rasterio.open(f).read(1) for f in fl]).astype(np.float64)
+    qa = np.stack([rasterio.open(f).read(2) for f in fl])
+    x[(x == 0) | (qa == 1)] = np.nan
+    return x
+
+def test_trend_skips_masked_observations(make_stack):
+    fl, dates = make_stack(n = 10, cloud = 0.3)
+    rts = RasterTimeSeries(fl, dates)
+
+    ts, mk, z = rts.trend(maskband = 2, rchunk = 16)
+    ts0, mk0, z0 = _theilsen_numpy(_masked(fl), _decimal_years(dates))
+
+    # nearly every pixel has gaps, but enough valid observations for a trend
+    assert np.isnan(_masked(fl)).any(axis = 0).mean() > 0.9
+    assert np.isfinite(ts).all()
+    np.testing.assert_allclose(ts, ts0)
+    np.testing.assert_array_equal(mk, mk0)
+    np.testing.assert_allclose(z, z0)
+
+def test_cube_and_pipeline_trend_match(make_stack, tmp_path):
+    fl, dates = make_stack(n = 10, cloud = 0.3)
+    rts = RasterTimeSeries(fl, dates)
+
+    ref = rts.trend(maskband = 2)
+    for out in [rts.pipeline().mask(maskband = 2).trend(), rts.to_cube(str(tmp_path / 'cube.zarr'), maskband = 2, chunks = (16, 16)).trend()]:
+        for a, b in zip(out, ref):
+            np.testing.assert_allclose(a, b)